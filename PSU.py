@@ -1,63 +1,32 @@
 import serial
 import pandas as pd
 import time
+import math
+import threading
+import os
+from datetime import datetime
+import drivers
+from event_trace import EventTrace
 #  TODO: Check if ocp is possible with the usb interface.
 
 
-def value_to_fixed_width_string_v(value):
+def info_step_print(step, voltage, current, duration):
     """
-    To produce a five character value with two digits, a point and two more
-    digits. For the voltage setting.
-
+    Prints the information of a step of a sequence
 
     Parameters
     ----------
-    value : float
+    step: int
+    voltage: float
+    current: float
+    duration: float
 
     Returns
     -------
-    value_string : string
 
     """
-    value_string = f'{value:2.2f}'
-    value_string = value_string.rjust(5, '0')
-    return value_string
-
-
-def value_to_fixed_width_string_i(value):
-    """
-    To produce a five character value with two digits, a point and two more
-    digits. For the current setting.
-
-
-    Parameters
-    ----------
-    value : float
-
-    Returns
-    -------
-    value_string : string
-
-    """
-    value_string = f'{value:1.3f}'
-    value_string = value_string.rjust(5, '0')
-    return value_string
-
-
-def info_csv_print(row):
-    """
-    Prints the information of a row of the csv file
-
-    Parameters
-    ----------
-    row: pandas DF row
-
-    Returns
-    -------
-
-    """
-    print(f"Step: {row['Step']:.0f}, Uset(V): {row['Uset(V)']}, Iset(A): "
-          f"{row['Iset(A)']}, Duration(s): {row['Duration(s)']}")
+    print(f"Step: {step}, Uset(V): {voltage}, Iset(A): {current}, "
+          f"Duration(s): {duration}")
 
 
 class PSU:
@@ -70,9 +39,13 @@ class PSU:
     close_serial
     read_csv
     write_serial
+    query
     write_serial_continually
     vset
     iset
+    queue_vset
+    queue_iset
+    flush_setpoints
     output_on
     output_off
     get_vset
@@ -81,27 +54,43 @@ class PSU:
     update_status
     get_vout
     get_iout
-    info_csv_print
     follow_csv
+    follow_profile
+    follow_steps
+    sample_step
     find_voltage_battery
     """
 
-    def __init__(self, com, baudrate=9600, timeout=1, serial_wait_time=0.05):
+    def __init__(self, com, baudrate=9600, timeout=1, serial_wait_time=None,
+                 channel=1, driver=None, use_driver_cache=True, trace=None):
         # TODO: Differentiate private and public variables
         """
         Opens the serial port for communication and updates the status of
         the device.
 
+        The model is found from the *IDN? reply and cached for the port, so
+        the next connection on the port does not ask again.
+
         Parameters
         ----------
-        com : str
-            The port of the connection
+        com : str or serial-like object
+            The port of the connection, or an open connection like
+            simulated_psu.SimulatedSerial. The driver cache is only used
+            for ports.
         baudrate : int
             The baudrate of the PSU
         timeout : float
             Timeout for communication
-        serial_wait_time : float
-            The time between sent commands.
+        serial_wait_time : float or None
+            The time between sent commands. None uses the one of the model.
+        channel : int
+            The output channel to control.
+        driver : str or None
+            Name of the driver to use instead of finding it.
+        use_driver_cache : bool
+            Use and update the driver cache.
+        trace : event_trace.EventTrace or None
+            Where the commands and replies are recorded. None makes one.
 
         Attributes
         ----------
@@ -113,8 +102,26 @@ class PSU:
         self.on : bool
         self.ocp : bool
         self.serial_wait_time : float
+        self.driver : drivers.Driver
+        self.channel : int
+        self.commands : dict[str, bytes]
+            The commands of the channel.
         self.end_char : bytes
         self.serial : serial connection
+        self.lock : threading.RLock
+            Held while talking to the PSU, so threads can share it.
+        self.interlock : threading.Event or None
+            When set the output can not be turned on.
+        self.pending_setpoints : dict
+            Queued set-points, the newest for each of voltage and current.
+        self.setpoints_sent : int
+        self.setpoints_saved : int
+            Set-points not written since they were already set or replaced
+            by a newer one before being sent.
+        self.step_totals : list[tuple]
+            Step, Ah and J of every step of the last sampled sequence.
+        self.trace : event_trace.EventTrace
+            The last commands, replies and their latencies.
         """
         self.df = None
         self.status = None
@@ -126,15 +133,56 @@ class PSU:
         self.serial_wait_time = serial_wait_time
         self.end_char = b'\\r\\n'  # /b'/n'
         self.identification = None
-
-        self.serial = serial.serial_for_url(com, baudrate=baudrate,
-                                            timeout=timeout)
-        self.write_serial(b'*IDN?')
-        self.identification = self.serial.read_until()
-        if self.identification == b'':
-            raise ConnectionError('The powersupply is off or not responding')
-        print(f'Connection: {self.identification}')
-        self.output_off()
+        self.driver = None
+        self.channel = channel
+        self.commands = None
+        self.pending_setpoints = {}
+        self.setpoints_sent = 0
+        self.setpoints_saved = 0
+        self.step_totals = []
+        self.lock = threading.RLock()
+        self.interlock = None
+        self.trace = trace if trace is not None else EventTrace()
+
+        if isinstance(com, str):
+            self.serial = serial.serial_for_url(com, baudrate=baudrate,
+                                                timeout=timeout)
+        else:
+            self.serial = com
+            use_driver_cache = False
+        cached = None
+        if driver is not None:
+            self.driver = drivers.get_driver(driver)
+        elif use_driver_cache:
+            cached = drivers.cached_driver(com)
+        if cached is not None:
+            self.driver, self.identification = cached
+        else:
+            if self.serial_wait_time is None:
+                self.serial_wait_time = drivers.DRIVERS[-1].serial_wait_time
+            self.identification = self.query(b'*IDN?')
+            if self.identification == b'':
+                raise ConnectionError('The powersupply is off or not '
+                                      'responding')
+            if self.driver is None:
+                self.driver = drivers.identify(self.identification)
+            if use_driver_cache:
+                drivers.cache_driver(com, self.driver, self.identification)
+        print(f'Connection: {self.identification}, {self.driver.name}')
+
+        if serial_wait_time is None:
+            self.serial_wait_time = self.driver.serial_wait_time
+        if not 1 <= channel <= self.driver.channels:
+            self.serial.close()
+            raise ValueError(f'{self.driver.name} has no channel {channel}.')
+        self.commands = self.driver.commands[channel]
+
+        try:
+            self.output_off()
+        except ConnectionError:
+            if cached is not None:
+                drivers.cache_driver(com, None, None)
+            raise
 
         # It updates status in output_off, but it is good to have
         self.update_status()
@@ -176,10 +224,33 @@ class PSU:
         Returns
         -------
         """
-        time.sleep(self.serial_wait_time)
-        self.serial.write(finished_command_no_endchar + self.end_char)
-        self.serial.flush()
-        time.sleep(self.serial_wait_time)
+        with self.lock:
+            self.trace.record('write', finished_command_no_endchar)
+            time.sleep(self.serial_wait_time)
+            self.serial.write(finished_command_no_endchar + self.end_char)
+            self.serial.flush()
+            time.sleep(self.serial_wait_time)
+
+    def query(self, command):
+        """
+        Writes a command and reads the reply, without other threads talking
+        to the PSU in between.
+
+        Parameters
+        ----------
+        command: bytes
+
+        Returns
+        -------
+        bytes
+            The reply.
+        """
+        with self.lock:
+            start = time.perf_counter()
+            self.write_serial(command)
+            reply = self.serial.read_until()
+            self.trace.record('reply', reply, time.perf_counter() - start)
+            return reply
 
     def write_serial_continually(self):
         """
@@ -195,34 +266,66 @@ class PSU:
             self.write_serial(input_string.encode() + self.end_char)
             print(self.serial.read_until())
 
-    def vset(self, value):
+    def vset(self, value, force=False):
         """
         For setting the voltage value. It confirms it has been set. It also
-        checks if the value is valid.
+        checks if the value is valid. Nothing is written if the PSU already
+        has the value.
 
         Parameters
         ----------
         value: float
             Voltage value for the PSU in volts.
+        force: bool
+            Write even if the PSU already has the value.
 
         Returns
         -------
         """
-        if value > 30:
-            raise ValueError(f'Value is larger than allowed voltage value. '
-                             f'{value}V > 30V')
+        if self.write_setpoint('vset', self.check_vset(value), force):
+            self.update_status()
 
-        value_string = value_to_fixed_width_string_v(value)
-        value_encoded = value_string.encode()
-        v_string = b''.join([b'VSET1:', value_encoded])
+    def iset(self, value, force=False):
+        """
+        For setting the current value. It confirms it has been set. It also
+        checks if the value is valid. Nothing is written if the PSU already
+        has the value.
 
-        self.write_serial(v_string)
-        self.update_status()
+        Parameters
+        ----------
+        value: float
+            Current value for the PSU in amperes.
+        force: bool
+            Write even if the PSU already has the value.
 
-    def iset(self, value):
+        Returns
+        -------
         """
-        For setting the current value. It confirms it has been set. It also
-        checks if the value is valid.
+        if self.write_setpoint('iset', self.check_iset(value), force):
+            self.update_status()
+
+    def check_vset(self, value):
+        """
+        Checks the voltage value and formats it for the PSU.
+
+        Parameters
+        ----------
+        value: float
+            Voltage value for the PSU in volts.
+
+        Returns
+        -------
+        str
+            The fixed width value.
+        """
+        if value > self.driver.voltage_max:
+            raise ValueError(f'Value is larger than allowed voltage value. '
+                             f'{value}V > {self.driver.voltage_max}V')
+        return self.driver.format_voltage(value)
+
+    def check_iset(self, value):
+        """
+        Checks the current value and formats it for the PSU.
 
         Parameters
         ----------
@@ -231,27 +334,119 @@ class PSU:
 
         Returns
         -------
+        str
+            The fixed width value.
         """
-        if value > 5:
+        if value > self.driver.current_max:
             raise ValueError(f'Value is larger than allowed current value. '
-                             f'{value}A > 5A')
+                             f'{value}A > {self.driver.current_max}A')
+        return self.driver.format_current(value)
 
-        value_string = value_to_fixed_width_string_i(value)
-        value_encoded = value_string.encode()
-        i_string = b''.join([b'ISET1:', value_encoded])
+    def write_setpoint(self, command, value_string, force=False):
+        """
+        Writes a set-point unless the last status read from the PSU already
+        has the same value. Does not update the status.
 
-        self.write_serial(i_string)
-        self.update_status()
+        Parameters
+        ----------
+        command: str
+            'vset' or 'iset'.
+        value_string: str
+            The fixed width value.
+        force: bool
+            Write even if the PSU already has the value.
+
+        Returns
+        -------
+        bool
+            If it was written.
+        """
+        if command == 'vset':
+            cached = self.set_v
+            to_string = self.driver.format_voltage
+        else:
+            cached = self.set_i
+            to_string = self.driver.format_current
+        if not force and cached is not None and \
+                to_string(cached) == value_string:
+            self.setpoints_saved += 1
+            return False
+
+        self.write_serial(self.commands[command] + value_string.encode())
+        self.setpoints_sent += 1
+        return True
+
+    def queue_vset(self, value):
+        """
+        Queues a voltage value to be set by flush_setpoints. It replaces a
+        voltage value already waiting.
+
+        Parameters
+        ----------
+        value: float
+            Voltage value for the PSU in volts.
+
+        Returns
+        -------
+        """
+        self.queue_setpoint('vset', self.check_vset(value))
+
+    def queue_iset(self, value):
+        """
+        Queues a current value to be set by flush_setpoints. It replaces a
+        current value already waiting.
+
+        Parameters
+        ----------
+        value: float
+            Current value for the PSU in amperes.
+
+        Returns
+        -------
+        """
+        self.queue_setpoint('iset', self.check_iset(value))
+
+    def queue_setpoint(self, command, value_string):
+        """
+        Queues a checked set-point.
+
+        Parameters
+        ----------
+        command: str
+        value_string: str
+
+        Returns
+        -------
+        """
+        if command in self.pending_setpoints:
+            self.setpoints_saved += 1
+        self.pending_setpoints[command] = value_string
+
+    def flush_setpoints(self):
+        """
+        Writes the queued set-points that differ from the PSU and updates
+        the status once afterwards.
+
+        Returns
+        -------
+        """
+        written = False
+        for command, value_string in self.pending_setpoints.items():
+            written |= self.write_setpoint(command, value_string)
+        self.pending_setpoints = {}
+        if written:
+            self.update_status()
 
     def output_on(self):
         """
-        Turns the output on
+        Turns the output on, unless the interlock is set.
 
         Returns
         -------
         """
-        output_string = b'OUTPUT1'
-        self.write_serial(output_string)
+        if self.interlock is not None and self.interlock.is_set():
+            raise RuntimeError('The output is locked off by the interlock.')
+        self.write_serial(self.commands['output_on'])
         self.update_status()
 
     def output_off(self):
@@ -261,8 +456,7 @@ class PSU:
         Returns
         -------
         """
-        output_string = b'OUTPUT0'
-        self.write_serial(output_string)
+        self.write_serial(self.commands['output_off'])
         self.update_status()
 
     def get_vset(self):
@@ -274,8 +468,7 @@ class PSU:
         float
             The set voltage value
         """
-        self.write_serial(b'VSET1?')
-        vset = self.serial.read_until()
+        vset = self.query(self.commands['get_vset'])
         vset = float(vset.decode())
         return vset
 
@@ -288,8 +481,7 @@ class PSU:
         float
             The set current value
         """
-        self.write_serial(b'ISET1?')
-        iset = self.serial.read_until()
+        iset = self.query(self.commands['get_iset'])
         iset = float(iset.decode())
         return iset
 
@@ -304,8 +496,7 @@ class PSU:
         """
         # self.status = b''  # Don't think this is needed this any longer
         # Can check for length of the serial read if multiple call are needed.
-        self.write_serial(b'STATUS?')
-        return self.serial.read_until()
+        return self.query(self.commands['status'])
 
     def update_status(self, verbose=False):
         """
@@ -323,6 +514,8 @@ class PSU:
         -------
         """
         self.status = self.get_status()
+        if len(self.status) < 3:
+            raise ConnectionError('The powersupply is off or not responding')
 
         # 49 is the binary for 1 in this encoding
         if self.status[0] == 49:
@@ -354,8 +547,7 @@ class PSU:
         float
             The voltage output value
         """
-        self.write_serial(b'VOUT1?')
-        vout = self.serial.read_until()
+        vout = self.query(self.commands['vout'])
         vout = float(vout.decode())
         return vout
 
@@ -368,12 +560,11 @@ class PSU:
         float
             The current output value
         """
-        self.write_serial(b'IOUT1?')
-        iout = self.serial.read_until()
+        iout = self.query(self.commands['iout'])
         iout = float(iout.decode())
         return iout
 
-    def follow_csv(self, repetitions=1):
+    def follow_csv(self, repetitions=1, sample_rate=None, log=None):
         """
         Follows the instructions of the loaded csv. If no csv then it
         returns empty without doing anything.
@@ -382,6 +573,10 @@ class PSU:
         ----------
         repetitions : int
             Number of repetitions of the csv
+        sample_rate : float or None
+            Measurements per second during the steps. None measures nothing.
+        log : session_checkpoint.SessionCheckpoint or None
+            Where the measurements are written.
 
         Returns
         -------
@@ -391,17 +586,176 @@ class PSU:
             print('No sequence file loaded')
             return
 
+        chunk = (self.df['Uset(V)'].to_numpy(dtype=float),
+                 self.df['Iset(A)'].to_numpy(dtype=float),
+                 self.df['Duration(s)'].to_numpy(dtype=float))
+        self.follow_steps([chunk] * repetitions, sample_rate=sample_rate,
+                          log=log)
+
+    def follow_profile(self, profile, repetitions=1, verbose=False,
+                       sample_rate=None, log=None):
+        """
+        Follows a profile from profile_builder.
+
+        Parameters
+        ----------
+        profile : profile_builder.Profile
+        repetitions : int
+            Number of repetitions of the profile
+        verbose : bool
+            Print every step.
+        sample_rate : float or None
+            Measurements per second during the steps. None measures nothing.
+        log : session_checkpoint.SessionCheckpoint or None
+            Where the measurements are written.
+
+        Returns
+        -------
+
+        """
+        self.follow_steps((chunk for _ in range(repetitions)
+                           for chunk in profile.chunks()), verbose,
+                          sample_rate, log)
+
+    def follow_steps(self, chunks, verbose=True, sample_rate=None, log=None):
+        """
+        Sets the steps one after another. Each step ends at a deadline from
+        the start, so the time spent talking to the PSU does not add up.
+
+        With a sample rate the output is measured during the steps, see
+        sample_step. The samples go to the log in the journal format of the
+        charger, with the output voltage as charging voltage, NaN as battery
+        voltage and the step number in the SOC column. The Ah and J of every
+        step are kept in step_totals and written to steps.csv next to the
+        journal.
+
+        Parameters
+        ----------
+        chunks : iterable[tuple]
+            Voltage, current and duration arrays.
+        verbose : bool
+            Print every step.
+        sample_rate : float or None
+            Measurements per second during the steps. None measures nothing.
+        log : session_checkpoint.SessionCheckpoint or None
+            Where the measurements are written.
+
+        Returns
+        -------
+
+        """
         # More checks
         self.vset(0.0)
         self.iset(0.0)
         self.output_on()
 
-        for rep in range(repetitions):
-            for index, row in self.df.iterrows():
-                info_csv_print(row)
-                self.vset(row['Uset(V)'])
-                self.iset(row['Iset(A)'])
-                time.sleep(row['Duration(s)'])
+        step_file = None
+        if sample_rate is not None:
+            self.step_totals = []
+            if log is not None:
+                log.start(identification=self.identification.decode(
+                    errors='replace').strip(), sample_rate=sample_rate)
+                step_file = open(os.path.join(log.directory, 'steps.csv'),
+                                 'w')
+                step_file.write('Step,Ah,J\n')
+
+        step = 0
+        deadline = time.monotonic()
+        for voltage, current, duration in chunks:
+            for index in range(len(duration)):
+                step += 1
+                if verbose:
+                    info_step_print(step, voltage[index], current[index],
+                                    duration[index])
+                self.queue_vset(voltage[index])
+                self.queue_iset(current[index])
+                self.flush_setpoints()
+                step_start = deadline
+                deadline += float(duration[index])
+                if sample_rate is None:
+                    remaining = deadline - time.monotonic()
+                    if remaining > 0:
+                        time.sleep(remaining)
+                    continue
+
+                ampere_hours, energy = self.sample_step(
+                    step, step_start, deadline, 1 / sample_rate, log)
+                self.step_totals.append((step, ampere_hours, energy))
+                if step_file is not None:
+                    step_file.write(f'{step},{ampere_hours!r},{energy!r}\n')
+                if verbose:
+                    print(f'Step {step}: {1000 * ampere_hours:.3f}mAh and '
+                          f'{energy:.3f}J')
+
+        if step_file is not None:
+            step_file.close()
+            log.close()
+        print(f'Set-points sent: {self.setpoints_sent}, saved: '
+              f'{self.setpoints_saved}')
+
+    def sample_step(self, step, start, end, period, log=None):
+        """
+        Measures the output current and voltage until the end of a step.
+        The sample times are fixed from the start of the step, and a sample
+        time missed because the PSU was slow is skipped, so there is no
+        drift. The current and voltage of a sample count until the next
+        sample, or the end of the step. The first sample also counts back to
+        the start of the step, since the time spent setting the step is part
+        of it.
+
+        Parameters
+        ----------
+        step : int
+            The step number.
+        start : float
+            time.monotonic at the start of the step.
+        end : float
+            time.monotonic at the end of the step.
+        period : float
+            Seconds between samples.
+        log : session_checkpoint.SessionCheckpoint or None
+            Where the measurements are written.
+
+        Returns
+        -------
+        float
+            Charge in Ah during the step.
+        float
+            Energy in J during the step.
+        """
+        ampere_hours = 0.0
+        energy = 0.0
+        last = None
+        sample_time = start
+        while True:
+            now = time.monotonic()
+            if now >= end:
+                break
+            if now < sample_time:
+                time.sleep(min(sample_time, end) - now)
+                continue
+
+            current = self.get_iout()
+            voltage = self.get_vout()
+            if last is not None:
+                seconds = now - last[0]
+                ampere_hours += seconds / 3600 * last[1]
+                energy += seconds * last[1] * last[2]
+            else:
+                seconds = now - start
+                ampere_hours += seconds / 3600 * current
+                energy += seconds * current * voltage
+            last = (now, current, voltage)
+            if log is not None:
+                log.record(datetime.now(), current, voltage, math.nan, step)
+            sample_time = start + period * (
+                math.floor((time.monotonic() - start) / period) + 1)
+
+        if last is not None:
+            seconds = end - last[0]
+            ampere_hours += seconds / 3600 * last[1]
+            energy += seconds * last[1] * last[2]
+        return ampere_hours, energy
 
     def find_voltage_battery(self, safe_voltage=5, checking_current=0.000,
                              wait_for_measurement=0.5):
@@ -0,0 +1,324 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import yaml
+
+import battery_charger
+
+
+# The {cell} before the first _ of the default CSVFile
+CELL_PATTERN = r'^(?P<cell>[^_]+)_'
+
+
+def file_hash(path):
+    """
+    Gives the SHA-256 of the content of a file.
+
+    Parameters
+    ----------
+    path : str
+
+    Returns
+    -------
+    str
+        The hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def soc_from_ocv(voltage, battery_params):
+    """
+    Estimates the SOC from the open circuit voltage by interpolating the
+    SOC_OCV table.
+
+    Parameters
+    ----------
+    voltage : float or numpy.ndarray
+        Battery voltage.
+    battery_params : dict
+        The parameters of one battery from battery_params.yml.
+
+    Returns
+    -------
+    float or numpy.ndarray
+        SOC in percent.
+    """
+    soc = sorted(battery_params['SOC_OCV'])
+    ocv = [battery_params['SOC_OCV'][key] for key in soc]
+    return np.interp(voltage, ocv, soc)
+
+
+def analyse_log(path, battery_params=None, min_current=0.01):
+    """
+    Computes the numbers for one log written by save_data_csv.
+
+    The internal resistance is the median of (charge voltage - battery
+    voltage) / current, since the battery voltage is measured without load.
+    The capacity is the charged Ah divided by the change in SOC, and is only
+    given if the SOC changed by at least 10%.
+
+    Parameters
+    ----------
+    path : str
+        The csv file.
+    battery_params : dict or None
+        The parameters of the battery, used for the SOC estimates.
+    min_current : float
+        Samples below this current are not used for the resistance.
+
+    Returns
+    -------
+    dict
+        The results for the session.
+    """
+    df = pd.read_csv(path, usecols=['Time', 'Current', 'Charge Voltage',
+                                    'Battery Voltage'])
+    times = pd.to_datetime(df['Time']).to_numpy()
+    current = df['Current'].to_numpy(dtype=float)
+    voltage = df['Charge Voltage'].to_numpy(dtype=float)
+    battery_voltage = df['Battery Voltage'].to_numpy(dtype=float)
+
+    result = {'File': path, 'Samples': len(df), 'Start': None,
+              'Duration(s)': 0.0, 'Ah': 0.0, 'J': 0.0,
+              'Resistance(Ohm)': np.nan, 'StartSOC': np.nan,
+              'EndSOC': np.nan, 'Capacity(Ah)': np.nan}
+    if len(df) == 0:
+        return result
+
+    result['Start'] = str(times[0])
+    result['Duration(s)'] = float((times[-1] - times[0]) /
+                                  np.timedelta64(1, 's'))
+    result['Ah'], result['J'] = battery_charger.amount_charged(current,
+                                                               voltage, times)
+
+    loaded = current > min_current
+    if loaded.any():
+        resistance = (voltage[loaded] - battery_voltage[loaded]) / \
+            current[loaded]
+        result['Resistance(Ohm)'] = float(np.median(resistance))
+
+    if battery_params is not None:
+        start_soc, end_soc = soc_from_ocv(battery_voltage[[0, -1]],
+                                          battery_params)
+        result['StartSOC'] = float(start_soc)
+        result['EndSOC'] = float(end_soc)
+        if end_soc - start_soc >= 10:
+            result['Capacity(Ah)'] = result['Ah'] / \
+                ((end_soc - start_soc) / 100)
+    return result
+
+
+def load_cache(cache_file):
+    """
+    Loads the result cache.
+
+    Parameters
+    ----------
+    cache_file : str
+
+    Returns
+    -------
+    dict
+        With 'results' keyed by content hash and 'files' mapping a path to
+        its size, modification time and hash.
+    """
+    try:
+        with open(cache_file, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {'results': {}, 'files': {}}
+
+
+def save_cache(cache, cache_file):
+    """
+    Writes the result cache atomically.
+
+    Parameters
+    ----------
+    cache : dict
+    cache_file : str
+
+    Returns
+    -------
+
+    """
+    temporary_file = cache_file + '.tmp'
+    with open(temporary_file, 'w') as file:
+        json.dump(cache, file)
+    os.replace(temporary_file, cache_file)
+
+
+def cached_hash(path, cache):
+    """
+    Gives the content hash of a file, only reading the file if its size or
+    modification time changed since it was hashed last.
+
+    Parameters
+    ----------
+    path : str
+    cache : dict
+
+    Returns
+    -------
+    str
+        The hex digest.
+    """
+    stat = os.stat(path)
+    known = cache['files'].get(path)
+    if known is not None and known['size'] == stat.st_size and \
+            known['mtime'] == stat.st_mtime_ns:
+        return known['hash']
+    digest = file_hash(path)
+    cache['files'][path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                            'hash': digest}
+    return digest
+
+
+def analyse_archive(pattern='Data/*.csv', battery=None, workers=None,
+                    cache_file='Data/analysis_cache.json',
+                    cell_pattern=CELL_PATTERN):
+    """
+    Analyses every log matching the pattern with a pool of worker
+    processes. Only logs whose content is not in the cache are analysed.
+    A log that can not be analysed, like a csv file of something else, gets
+    a row with the error and is tried again next time.
+
+    The cell of a log is taken from its file name with cell_pattern, and the
+    capacity fade is the capacity relative to the first session of the cell.
+    The default pattern takes the name up to the first underscore, which is
+    {cell} in the default CSVFile of charge_params.yml. Logs of sessions
+    without a Cell setting have no cell and no capacity fade.
+
+    Parameters
+    ----------
+    pattern : str
+        Glob pattern for the logs.
+    battery : str or None
+        Battery in battery_params.yml, used for the SOC and capacity.
+    workers : int or None
+        Number of processes. None uses the number of CPUs.
+    cache_file : str or None
+        Where to keep the results between runs. None disables the cache.
+    cell_pattern : str
+        Regular expression with a group named cell.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per session, with Error set if it could not be analysed.
+    """
+    battery_params = None
+    if battery is not None:
+        with open('Config/battery_params.yml', 'r') as file:
+            battery_params = yaml.safe_load(file)[battery]
+
+    cache = load_cache(cache_file) if cache_file is not None else \
+        {'results': {}, 'files': {}}
+    results = cache['results']
+
+    paths = sorted(glob.glob(pattern))
+    hashes = {path: cached_hash(path, cache) for path in paths}
+    new_paths = {}
+    for path, digest in hashes.items():
+        if digest not in results or \
+                results[digest].get('Battery') != battery:
+            new_paths.setdefault(digest, path)
+    print(f'{len(paths)} logs, {len(new_paths)} to analyse')
+
+    errors = {}
+    if new_paths:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {digest: executor.submit(analyse_log, path,
+                                               battery_params)
+                       for digest, path in new_paths.items()}
+            for digest, future in futures.items():
+                try:
+                    result = future.result()
+                except Exception as error:
+                    errors[digest] = {'File': new_paths[digest],
+                                      'Error': f'{type(error).__name__}: '
+                                               f'{error}'}
+                    print(f'Skipped {new_paths[digest]}: {error}')
+                    continue
+                result['Battery'] = battery
+                results[digest] = result
+
+    if cache_file is not None:
+        save_cache(cache, cache_file)
+
+    rows = []
+    cell_regex = re.compile(cell_pattern)
+    for path, digest in hashes.items():
+        row = dict(errors.get(digest) or results[digest], File=path,
+                   Hash=digest)
+        row.setdefault('Error', None)
+        row['Cell'] = cell_from_path(path, cell_regex)
+        rows.append(row)
+    df = pd.DataFrame(rows)
+    if df.empty:
+        return df
+
+    df = df.sort_values(['Cell', 'Start']).reset_index(drop=True)
+    first_capacity = df.groupby('Cell')['Capacity(Ah)'].transform(
+        lambda capacity: capacity.dropna().iloc[0]
+        if capacity.notna().any() else np.nan)
+    df['CapacityFade'] = 1 - df['Capacity(Ah)'] / first_capacity
+    return df
+
+
+def cell_from_path(path, cell_regex):
+    """
+    Gives the cell of a log from its file name.
+
+    Parameters
+    ----------
+    path : str
+    cell_regex : re.Pattern
+        With a group named cell.
+
+    Returns
+    -------
+    str or None
+        The cell, or None if the name does not match or the cell was not
+        set when the log was written.
+    """
+    match = cell_regex.search(os.path.splitext(os.path.basename(path))[0])
+    if match is None or match.group('cell') == battery_charger.UNKNOWN_CELL:
+        return None
+    return match.group('cell')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Analyses the charge logs written by save_data_csv.')
+    parser.add_argument('pattern', nargs='?', default='Data/*.csv')
+    parser.add_argument('--battery', default=None,
+                        help='Battery in Config/battery_params.yml')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--cache', default='Data/analysis_cache.json')
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--cell-pattern', default=CELL_PATTERN)
+    parser.add_argument('--output', default=None, help='Summary csv file')
+    args = parser.parse_args()
+
+    df = analyse_archive(args.pattern, args.battery, args.workers,
+                         None if args.no_cache else args.cache,
+                         args.cell_pattern)
+    if args.output is not None:
+        df.to_csv(args.output, index=False)
+    print(df.to_string())
+
+
+if __name__ == '__main__':
+    main()
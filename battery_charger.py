@@ -3,9 +3,28 @@ import PSU
 import yaml
 import pprint
 import time
+import os
+import sqlite3
 from datetime import datetime
 import pandas as pd
+import numpy as np
 import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+from session_checkpoint import SessionCheckpoint
+from sample_history import DecimatedHistory
+import plot_renderer
+import termination
+import binary_log
+from sampler import Sampler
+from safety_watchdog import Watchdog
+from event_trace import EventTrace
+import session_db
+from simulated_psu import SimulatedSerial
+
+
+# {cell} of the data files when Cell is not set
+UNKNOWN_CELL = 'unknown'
+EPOCH = datetime(1970, 1, 1)
 
 
 class BatteryCharger:
@@ -17,9 +36,19 @@ class BatteryCharger:
     __init__
     start_serial
     settings
+    resume_session
     unsafe_charge
     charge
+    data_filename
+    save_session
+    stop_after_error
+    dump_trace
+    stop_workers
     update_data
+    read_output
+    plot
+    sleep
+    wait_for_update
     charge_check
     charge_update
     charge_setup_high_level
@@ -31,9 +60,28 @@ class BatteryCharger:
     iset
     end
     """
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, interactive=True, charge_params=None, psu=None,
+                 **kwargs):
+        """
+        Reads the settings and starts the serial connection if they are
+        confirmed.
+
+        Parameters
+        ----------
+        args
+            To PSU.PSU
+        interactive : bool
+            Ask for confirmation of the settings.
+        charge_params : dict or None
+            Values overriding those of charge_params.yml.
+        psu : PSU.PSU or None
+            An open PSU to use instead of opening the port.
+        kwargs
+            To PSU.PSU
+        """
         self.psu = None
         self.port = None
+        self.cell = None
         self.settings_confirmed = False
         self.started_serial = False
         self.battery = None
@@ -43,20 +91,34 @@ class BatteryCharger:
         self.soc = None
         self.current = None
         self.voltage = None
+        self.checkpoint = None
+        self.resumed = False
+        # No charge is counted from the last sample before a restart
+        self.restarted = False
+        self.ampere_hours = 0.0
+        self.energy = 0.0
+        self.termination = None
+        self.current_cap = None
+        self.sampler = None
+        self.watchdog = None
+        # Replaced by the trace of the PSU in start_serial
+        self.trace = EventTrace()
 
         # Plotting
         self.time_history = []
         self.voltage_history = []
         self.current_history = []
         self.battery_voltage_history = []
+        self.history = DecimatedHistory(3)
+        self.renderer = None
 
         # Setting up from the start if everything is ready
-        if self.settings():
-            self.start_serial(*args, **kwargs)
+        if self.settings(interactive, charge_params):
+            self.start_serial(*args, psu=psu, **kwargs)
         else:
             print('Set settings and start serial manually.')
 
-    def start_serial(self, *args, **kwargs):
+    def start_serial(self, *args, psu=None, **kwargs):
         """
         Initializes the serial connection.
 
@@ -64,6 +126,8 @@ class BatteryCharger:
         ----------
         args
             To the serial.serial_for_url
+        psu : PSU.PSU or None
+            An open PSU to use instead of opening the port.
         kwargs
             To the serial.serial_for_url
 
@@ -71,17 +135,31 @@ class BatteryCharger:
         -------
 
         """
-        self.psu = PSU.PSU(self.port, *args, **kwargs)
+        if psu is None:
+            trace_params = self.charge_params.get('Trace')
+            if trace_params is not None:
+                kwargs.setdefault('trace', EventTrace(
+                    trace_params['Size'], trace_params['Directory']))
+            psu = PSU.PSU(self.port, *args, **kwargs)
+        self.psu = psu
+        self.trace = psu.trace
         self.psu.output_off()
         self.started_serial = True
 
-    def settings(self):
+    def settings(self, interactive=True, overrides=None):
         """
         Reads and check the settings. Returns if settings are set.
 
         Capacity in battery_params overrule capacity in charge_params. It
         must have one.
 
+        Parameters
+        ----------
+        interactive : bool
+            Ask for confirmation. If False the settings are confirmed.
+        overrides : dict or None
+            Values overriding those of charge_params.yml.
+
         Returns
         -------
         bool
@@ -91,9 +169,16 @@ class BatteryCharger:
             charge_params = yaml.safe_load(file)
         with open('Config/battery_params.yml', 'r') as file:
             battery_params = yaml.safe_load(file)
+        if overrides is not None:
+            charge_params.update(overrides)
 
+        self.charge_params = charge_params
         self.battery = charge_params['Battery']
         self.port = charge_params['Port']
+        self.cell = charge_params.get('Cell')
+        if charge_params.get('CheckpointDir') is not None:
+            self.checkpoint = SessionCheckpoint(
+                charge_params['CheckpointDir'])
 
         if battery_params[self.battery]['Capacity'] is None:
             if charge_params['Capacity'] is None:
@@ -105,6 +190,10 @@ class BatteryCharger:
         self.battery_params = battery_params[self.battery]
         self.make_current_params()
 
+        if not interactive:
+            self.settings_confirmed = True
+            return True
+
         print('The settings are: ')
         pprint.pprint(self.battery_params)
         sure = input('Are you ok with these settings (y, n_): ')
@@ -114,6 +203,55 @@ class BatteryCharger:
         else:
             return False
 
+    def resume_session(self):
+        """
+        Restores SOC, histories and the charged amount from the checkpoint
+        of an unfinished session. The battery is not probed again when
+        charging continues.
+
+        Returns
+        -------
+        bool
+            If a session was resumed.
+        """
+        if self.checkpoint is None:
+            print('No checkpoint directory set.')
+            return False
+        state = self.checkpoint.resume()
+        if state is None:
+            print('No unfinished session to resume.')
+            return False
+        if state['meta'].get('battery') != self.battery:
+            self.checkpoint.close(finished=False)
+            raise ValueError(f'The checkpoint is for '
+                             f'{state["meta"].get("battery")}, not '
+                             f'{self.battery}.')
+
+        self.soc = state['soc']
+        times, current, voltage, battery_voltage = \
+            self.checkpoint.load_history()
+        self.history = DecimatedHistory(3)
+        self.history.extend((times - np.datetime64(EPOCH)) /
+                            np.timedelta64(1, 's'),
+                            np.column_stack([current, voltage,
+                                             battery_voltage]))
+        self.time_history = times.tolist()
+        self.current_history = current.tolist()
+        self.voltage_history = voltage.tolist()
+        self.battery_voltage_history = battery_voltage.tolist()
+        # The last sample may be from before an earlier resume
+        self.current = self.current_history[-1]
+        self.voltage = self.voltage_history[-1]
+        self.battery_voltage = self.battery_voltage_history[-1]
+        self.ampere_hours = state['ampere_hours']
+        self.energy = state['energy']
+        self.resumed = True
+        self.restarted = True
+        mah = 1000 * state['ampere_hours']
+        print(f'Resumed session at {self.soc}% after {mah:.0f}mAh and '
+              f'{state["energy"]:.0f}J')
+        return True
+
     def unsafe_charge(self, plotting=True, save_data=True):
         """
         Charges the battery. It checks for settings set, if the battery is
@@ -133,26 +271,57 @@ class BatteryCharger:
         if not self.charge_setup_high_level():
             return
         if plotting:
-            plot_graph(self.soc, self.current_history, self.voltage_history,
-                       self.time_history, self.battery_voltage_history)
+            self.renderer = plot_renderer.PlotRenderer(
+                self.charge_params.get('PlotFile'))
+            self.renderer.start()
+            self.plot()
+
+        if self.charge_params.get('Watchdog') is not None:
+            self.watchdog = Watchdog(
+                self.psu, self.battery_params['VoltageChargeCutOff'],
+                self.battery_params['VoltageMin'],
+                self.charge_params['Watchdog']['Period'],
+                self.charge_params['Watchdog']['OpenCircuitChecks'])
+            self.watchdog.start()
+        if self.charge_params.get('SampleRate') is not None:
+            self.sampler = Sampler(self.psu, self.charge_params['SampleRate'],
+                                   ampere_hours=self.ampere_hours,
+                                   energy=self.energy)
+            self.sampler.start()
+        if self.charge_params.get('Termination') is not None:
+            self.termination = termination.TerminationEngine(
+                self.battery_params['CurrentChargeCutOff'],
+                self.battery_params['VoltageMax'],
+                self.charge_params['Termination'])
 
         while self.charge_check():
-            time.sleep(120 / self.battery_params['SOC_CR'][self.soc])
+            if not self.wait_for_update(
+                    120 / self.battery_params['SOC_CR'][self.soc]):
+                break
             self.charge_update()
 
             self.update_data()
             if plotting:
-                plot_graph(self.soc, self.current_history,
-                           self.voltage_history, self.time_history,
-                           self.battery_voltage_history)
+                self.plot()
 
+        self.stop_workers()
         self.psu.output_off()
         print('Finished charging')
+        if self.checkpoint is not None:
+            self.checkpoint.close()
 
         if save_data:
+            csv_file = self.data_filename('CSVFile')
             save_data_csv(self.current_history, self.voltage_history,
                           self.time_history, self.battery_voltage_history,
-                          self.charge_params['CSVFile'])
+                          csv_file)
+            if self.charge_params.get('BinaryFile') is not None:
+                binary_log.save_data_binary(
+                    self.current_history, self.voltage_history,
+                    self.time_history, self.battery_voltage_history,
+                    self.data_filename('BinaryFile'))
+            if self.charge_params.get('SessionDB') is not None:
+                self.save_session(csv_file)
 
     def charge(self, plotting=True, save_data=True):
         """
@@ -170,31 +339,281 @@ class BatteryCharger:
         -------
 
         """
+        self.trace.install_signal_handlers()
         try:
             self.unsafe_charge(plotting, save_data)
         except ValueError as error:
-            self.psu.output_off()
+            self.dump_trace(error)
+            self.stop_after_error()
             print("Probably voltage or current set to be outside of allowed "
                   "values or battery params not set correctly")
             raise error
         except Exception as error:
-            self.psu.output_off()
+            self.dump_trace(error)
+            self.stop_after_error()
             print(f"Unexpected {error}, {type(error)}")
             raise error
+        finally:
+            self.trace.restore_signal_handlers()
+
+    def data_filename(self, key):
+        """
+        Gives a file name of the settings, with {battery}, {port}, {cell}
+        and {time} filled in, so sessions do not overwrite each other. The
+        cell is the Cell setting, or UNKNOWN_CELL if it is not set. The time
+        is the start of the session and can be formatted, like
+        {time:%Y%m%d_%H%M%S}.
+
+        Parameters
+        ----------
+        key : str
+            'CSVFile' or 'BinaryFile'.
+
+        Returns
+        -------
+        str
+        """
+        start = self.time_history[0] if self.time_history else datetime.now()
+        return self.charge_params[key].format(
+            battery=self.battery, port=os.path.basename(str(self.port)),
+            cell=self.cell or UNKNOWN_CELL, time=start)
+
+    def save_session(self, source=None):
+        """
+        Adds the session to the session database. The data is already
+        saved, so a database error is only printed.
+
+        Parameters
+        ----------
+        source : str or None
+            The csv file of the session.
+
+        Returns
+        -------
+
+        """
+        try:
+            connection = session_db.connect(self.charge_params['SessionDB'])
+            try:
+                session_db.add_session(
+                    connection, self.time_history, self.current_history,
+                    self.voltage_history, self.battery_voltage_history,
+                    self.battery, self.battery_params, self.port,
+                    self.psu.identification.decode(errors='replace').strip(),
+                    source, self.cell)
+            finally:
+                connection.close()
+        except sqlite3.Error as error:
+            print(f'Could not add the session to the database: {error}')
+
+    def stop_after_error(self):
+        """
+        Stops the workers and the plot renderer, turns the output off, and
+        leaves the checkpoint so the session can be resumed.
+
+        Returns
+        -------
+
+        """
+        self.stop_workers()
+        self.psu.output_off()
+        if self.checkpoint is not None:
+            self.checkpoint.close(finished=False)
+
+    def dump_trace(self, error):
+        """
+        Saves the last serial conversation and charge events after an error.
+        Failing to save does not hide the error.
+
+        Parameters
+        ----------
+        error : Exception
+
+        Returns
+        -------
+
+        """
+        self.trace.record('error', f'{type(error).__name__}: {error}')
+        try:
+            self.trace.dump(f'{type(error).__name__}: {error}')
+        except OSError as dump_error:
+            print(f'Could not save the trace: {dump_error}')
+
+    def stop_workers(self):
+        """
+        Stops the sampler, the watchdog and the plot renderer.
+
+        Returns
+        -------
+
+        """
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.sampler = None
+        if self.watchdog is not None:
+            self.watchdog.stop()
+            self.watchdog = None
+        if self.renderer is not None:
+            self.renderer.stop()
+            self.renderer = None
 
     def update_data(self):
         """
         Updates the time-, current-, charging voltage- and battery
-        voltage-history.
+        voltage-history, the decimated history and the charged amount.
+        The charged amount is taken from the sampler if it runs, which
+        raises if the sampler has stopped or fallen behind.
 
         Returns
         -------
 
         """
-        self.time_history.append(datetime.now())
+        now = datetime.now()
+        if self.sampler is not None:
+            self.sampler.check()
+            self.ampere_hours = self.sampler.ampere_hours
+            self.energy = self.sampler.energy
+        elif self.time_history and not self.restarted:
+            seconds = (now - self.time_history[-1]).total_seconds()
+            self.ampere_hours += seconds / 3600 * self.current_history[-1]
+            self.energy += seconds * self.current_history[-1] * \
+                self.voltage_history[-1]
+        self.restarted = False
+        self.time_history.append(now)
         self.current_history.append(self.current)
         self.voltage_history.append(self.voltage)
         self.battery_voltage_history.append(self.battery_voltage)
+        self.history.append(naive_seconds(self.time_history[-1]),
+                            (self.current, self.voltage, self.battery_voltage))
+        if self.checkpoint is not None:
+            self.checkpoint.record(self.time_history[-1], self.current,
+                                   self.voltage, self.battery_voltage,
+                                   self.soc)
+
+    def read_output(self):
+        """
+        Gets the charging current and voltage, from the latest sample of
+        the sampler if it runs. Raises if that sample is stale.
+
+        Returns
+        -------
+
+        """
+        if self.sampler is not None:
+            self.sampler.check()
+            _, self.current, self.voltage = self.sampler.latest
+        else:
+            self.current = self.psu.get_iout()
+            self.voltage = self.psu.get_vout()
+
+    def sleep(self, seconds):
+        """
+        Sleeps, but stops the charge as soon as the watchdog trips.
+
+        Parameters
+        ----------
+        seconds : float
+
+        Returns
+        -------
+
+        """
+        if self.watchdog is None:
+            time.sleep(seconds)
+        elif self.watchdog.wait(seconds):
+            raise RuntimeError(f'Watchdog tripped: {self.watchdog.fault}')
+
+    def wait_for_update(self, seconds):
+        """
+        Waits until the next charge update. With a termination engine the
+        output is measured every PollPeriod seconds meanwhile, and the
+        charge can be ended or the current stepped down right away. If the
+        sampler runs, the engine gets all its samples instead.
+
+        Parameters
+        ----------
+        seconds : float
+            Time to the next charge update.
+
+        Returns
+        -------
+        bool
+            Continue charging.
+        """
+        if self.termination is None:
+            self.sleep(seconds)
+            return True
+
+        poll_period = self.charge_params['Termination']['PollPeriod']
+        end = time.monotonic() + seconds
+        while True:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            self.sleep(min(poll_period, remaining))
+            self.read_output()
+            self.update_data()
+
+            if self.sampler is not None:
+                samples = self.sampler.drain()
+            else:
+                samples = [(time.monotonic(), self.current, self.voltage)]
+            action = termination.CONTINUE
+            for time_s, current, voltage in samples:
+                action = self.termination.update(time_s, voltage, current)
+                if action != termination.CONTINUE:
+                    break
+            if action != termination.CONTINUE:
+                self.trace.record('termination', action, self.current,
+                                  self.voltage)
+            if action == termination.STOP:
+                print(f'Charge ended early at {self.current}A and '
+                      f'{self.voltage}V')
+                return False
+            if action == termination.STEP_DOWN:
+                factor = self.charge_params['Termination']['StepDownFactor']
+                self.current_cap = max(
+                    self.current * factor,
+                    self.battery_params['CurrentChargeMin'])
+                print(f'Current stopped tapering, stepping down to '
+                      f'{self.current_cap:.3f}A')
+                self.iset(self.current_cap)
+
+        time_to_full = self.termination.time_to_full()
+        if time_to_full is not None:
+            print(f'Estimated time to full: {time_to_full / 60:.0f}min')
+        return True
+
+    def plot(self, max_points=2000):
+        """
+        Plots the history. Long histories are taken from the decimated
+        tiers, so the plot only costs the points shown. If a renderer is
+        running the plot is handed to it instead of drawn here.
+
+        Parameters
+        ----------
+        max_points : int
+            Maximum number of points to plot.
+
+        Returns
+        -------
+
+        """
+        if len(self.time_history) <= max_points:
+            frame = (self.soc, list(self.current_history),
+                     list(self.voltage_history), list(self.time_history),
+                     list(self.battery_voltage_history),
+                     (self.ampere_hours, self.energy))
+        else:
+            times, values = self.history.resolution(max_points)
+            times = (times * 1e6).astype('datetime64[us]')
+            frame = (self.soc, values[:, 0], values[:, 1], times,
+                     values[:, 2], (self.ampere_hours, self.energy))
+
+        if self.renderer is not None:
+            self.renderer.submit(*frame)
+        else:
+            plot_graph(*frame)
 
     def charge_check(self):
         """
@@ -227,9 +646,13 @@ class BatteryCharger:
         while self.battery_voltage > self.battery_params['SOC_OCV'][self.soc +
                                                                     10]:
             self.soc += 10
-        self.iset(self.battery_params['SOC_Current'][self.soc])
-        self.current = self.psu.get_iout()
-        self.voltage = self.psu.get_vout()
+            self.trace.record('soc', self.soc - 10, self.soc,
+                              self.battery_voltage)
+        current = self.battery_params['SOC_Current'][self.soc]
+        if self.current_cap is not None:
+            current = min(current, self.current_cap)
+        self.iset(current)
+        self.read_output()
         self.update_data()
 
     def charge_setup_high_level(self):
@@ -249,35 +672,48 @@ class BatteryCharger:
             print('Please start serial first.')
             return False
 
-        if not self.ready_before_charge():
-            print('Check battery or parameters.')
-            return False
-
-        self.charge_setup_low_level()
+        if self.resumed:
+            self.charge_setup_low_level(self.soc)
+        else:
+            if not self.ready_before_charge():
+                print('Check battery or parameters.')
+                return False
+            self.charge_setup_low_level()
+            if self.checkpoint is not None:
+                self.checkpoint.start(battery=self.battery, port=self.port,
+                                      cell=self.cell)
         self.update_data()
         return True
 
-    def charge_setup_low_level(self):
+    def charge_setup_low_level(self, soc=None):
         """
         Does the setup for the charge, computing SOC, safely setting the
         voltage- and current-values and getting the voltage and current
         outputs.
 
+        Parameters
+        ----------
+        soc : int or None
+            A known SOC, from a resumed session. Computed from the battery
+            voltage if None.
+
         Returns
         -------
 
         """
-        soc = 0
-        while self.battery_voltage > self.battery_params['SOC_OCV'][soc + 10]:
-            soc += 10
+        if soc is None:
+            soc = 0
+            while self.battery_voltage > self.battery_params['SOC_OCV'][
+                    soc + 10]:
+                soc += 10
+        self.trace.record('soc', self.soc, soc, self.battery_voltage)
         self.soc = soc
 
         self.psu.output_off()
         self.iset(self.battery_params['SOC_Current'][soc])
         self.vset(self.battery_params['VoltageMax'])
         self.psu.output_on()
-        self.current = self.psu.get_iout()
-        self.voltage = self.psu.get_vout()
+        self.read_output()
 
     def ready_before_charge(self):
         """
@@ -324,16 +760,22 @@ class BatteryCharger:
 
     def check_voltage(self):
         """
-        Checks battery voltage with parameters.
+        Checks battery voltage with parameters. The sampler is paused
+        meanwhile, since the current is set to zero for the measurement.
 
         Returns
         -------
         float
             The voltage of the battery.
         """
-        battery_voltage = self.psu.find_voltage_battery(self.battery_params[
-                                                            'VoltageMax'],
-                                                        0.000)
+        if self.sampler is not None:
+            self.sampler.pause()
+        try:
+            battery_voltage = self.psu.find_voltage_battery(
+                self.battery_params['VoltageMax'], 0.000)
+        finally:
+            if self.sampler is not None:
+                self.sampler.resume()
         return battery_voltage
 
     def vset(self, value):
@@ -351,6 +793,7 @@ class BatteryCharger:
         """
         if self.battery_params['VoltageMin'] <= value <= self.battery_params[
                 'VoltageMax']:
+            self.trace.record('setpoint', 'vset', value)
             self.psu.vset(value)
         else:
             raise ValueError(f'Voltage not allowed. It should be '
@@ -373,6 +816,7 @@ class BatteryCharger:
         """
         if self.battery_params['CurrentChargeMin'] <= value <= \
                 self.battery_params['CurrentChargeMax']:
+            self.trace.record('setpoint', 'iset', value)
             self.psu.iset(value)
         else:
             raise ValueError(f'Current not allowed. It should be '
@@ -392,8 +836,9 @@ class BatteryCharger:
 
 
 def plot_graph(soc, current_history, voltage_history, time_history,
-               battery_voltage_history):
+               battery_voltage_history, charged=None):
     """
+    Shows the graph of the charge in a pyplot window.
 
     Parameters
     ----------
@@ -407,41 +852,82 @@ def plot_graph(soc, current_history, voltage_history, time_history,
         A list of times for measurements.
     battery_voltage_history : list[float]
         A list of battery voltages.
+    charged : tuple[float, float] or None
+        Charge in Ah and energy in J for the title. Computed from the
+        histories if None.
 
     Returns
     -------
 
     """
-    # TODO: Maybe return the figure instead of showing it here.
-    plt.style.use('dark_background')
-    fig, ax1 = plt.subplots(1)
-    fig.suptitle(f'Battery charge {soc}%')
-
-    ax1.plot(time_history, current_history, color='b', label='Current')
-    ax1.set_xlabel('Time')
-    ax1.xaxis.axis_date()
-    ax1.set_ylabel('Current (A)', color='b')
-
-    ax2 = ax1.twinx()
-    ax2.plot(time_history, voltage_history, color='r', label='Charging '
-                                                             'Voltage')
-    ax2.plot(time_history, battery_voltage_history, color='orange',
-             label='Battery Voltage')
-    ax2.set_ylabel('Voltage (V)', color='r')
-
-    ah, energy = amount_charged(current_history, voltage_history, time_history)
-    mah = 1000 * ah
-    ax1.set_title(f'Charged {mah:.0f}mAh and {energy:.0f}J')
-
-    my_fmt = mdates.DateFormatter("%H:%M")
-    ax1.xaxis.set_major_formatter(my_fmt)
-
-    ax2.legend()
-    fig.autofmt_xdate()
-    fig.tight_layout()
+    fig = make_figure(soc, current_history, voltage_history, time_history,
+                      battery_voltage_history, charged, pyplot=True)
     fig.show()
 
 
+def make_figure(soc, current_history, voltage_history, time_history,
+                battery_voltage_history, charged=None, pyplot=False):
+    """
+    Makes the figure of the charge. Without pyplot the figure is not
+    connected to any GUI backend, so it can be made in any thread and saved
+    with savefig.
+
+    Parameters
+    ----------
+    soc : int
+        The state of charge on percent. Must be a multiple of 10.
+    current_history : list[float]
+        A list of charging currents.
+    voltage_history : list[float]
+        A list of charging voltages.
+    time_history : list[datetime]
+        A list of times for measurements.
+    battery_voltage_history : list[float]
+        A list of battery voltages.
+    charged : tuple[float, float] or None
+        Charge in Ah and energy in J for the title. Computed from the
+        histories if None.
+    pyplot : bool
+        Make the figure with pyplot so it can be shown.
+
+    Returns
+    -------
+    matplotlib.figure.Figure
+        The figure.
+    """
+    with plt.style.context('dark_background'):
+        fig = plt.figure() if pyplot else Figure()
+        ax1 = fig.subplots(1)
+        fig.suptitle(f'Battery charge {soc}%')
+
+        ax1.plot(time_history, current_history, color='b', label='Current')
+        ax1.set_xlabel('Time')
+        ax1.xaxis.axis_date()
+        ax1.set_ylabel('Current (A)', color='b')
+
+        ax2 = ax1.twinx()
+        ax2.plot(time_history, voltage_history, color='r',
+                 label='Charging Voltage')
+        ax2.plot(time_history, battery_voltage_history, color='orange',
+                 label='Battery Voltage')
+        ax2.set_ylabel('Voltage (V)', color='r')
+
+        if charged is None:
+            charged = amount_charged(current_history, voltage_history,
+                                     time_history)
+        ah, energy = charged
+        mah = 1000 * ah
+        ax1.set_title(f'Charged {mah:.0f}mAh and {energy:.0f}J')
+
+        my_fmt = mdates.DateFormatter("%H:%M")
+        ax1.xaxis.set_major_formatter(my_fmt)
+
+        ax2.legend()
+        fig.autofmt_xdate()
+        fig.tight_layout()
+    return fig
+
+
 def amount_charged(current_history, voltage_history, time_history):
     """
     Gives the charge and energy given in Ah and J.
@@ -452,7 +938,7 @@ def amount_charged(current_history, voltage_history, time_history):
         A list of charging currents.
     voltage_history : list[float]
         A list of charging voltages.
-    time_history : list[datetime]
+    time_history : list[datetime] or numpy.ndarray
         A list of times for measurements.
 
     Returns
@@ -463,21 +949,55 @@ def amount_charged(current_history, voltage_history, time_history):
         Energy charged J.
 
     """
-    ampere_hours = 0
-    energy = 0
-    for index in range(len(current_history) - 1):
-        delta_t = time_history[index + 1] - time_history[index]
-        seconds = delta_t.total_seconds()
-        hours = seconds / 3600
-        current = current_history[index]
-        voltage = voltage_history[index]
-
-        ampere_hours += hours * current
-        energy += seconds * current * voltage
-
+    if len(time_history) < 2:
+        return 0.0, 0.0
+    times = to_datetime64(time_history)
+    seconds = np.diff(times) / np.timedelta64(1, 's')
+    current = np.asarray(current_history, dtype=float)[:-1]
+    voltage = np.asarray(voltage_history, dtype=float)[:-1]
+
+    ampere_hours = float(np.dot(seconds, current)) / 3600
+    energy = float(np.dot(seconds, current * voltage))
     return ampere_hours, energy
 
 
+def naive_seconds(time_stamp):
+    """
+    Gives the seconds since 1970-01-01 of a datetime as it is, like
+    binary_log.to_seconds, so a local time stays the same local time when
+    converted back with datetime64. datetime.timestamp would shift it by
+    the UTC offset.
+
+    Parameters
+    ----------
+    time_stamp : datetime
+
+    Returns
+    -------
+    float
+    """
+    return (time_stamp - EPOCH).total_seconds()
+
+
+def to_datetime64(time_history):
+    """
+    Converts times to a datetime64 array. numpy converts a list of
+    datetimes one by one, pandas is many times faster.
+
+    Parameters
+    ----------
+    time_history : list[datetime] or numpy.ndarray
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    if isinstance(time_history, np.ndarray) and \
+            np.issubdtype(time_history.dtype, np.datetime64):
+        return time_history
+    return pd.to_datetime(time_history).to_numpy()
+
+
 def save_data_csv(current_history, voltage_history, time_history,
                   battery_voltage_history, filename):
     """
@@ -541,5 +1061,48 @@ def save_data_test():
     print(df.info())
 
 
+def resume_test(samples=1000):
+    """
+    Charges on a simulated PSU, stops without closing the checkpoint as a
+    crash would, and checks that a new charger resumes the same session.
+    """
+    with open('Config/battery_params.yml', 'r') as file:
+        battery_params = yaml.safe_load(file)['Ronda-Li-Ion']
+    overrides = {'Battery': 'Ronda-Li-Ion',
+                 'CheckpointDir': 'Data/TestCheckpoint', 'SampleRate': None,
+                 'Termination': None, 'Watchdog': None, 'SessionDB': None}
+    chargers = []
+    for _ in range(2):
+        psu = PSU.PSU(SimulatedSerial(battery_params, soc=30),
+                      serial_wait_time=0.0)
+        chargers.append(BatteryCharger(interactive=False,
+                                       charge_params=overrides, psu=psu))
+    crashed, resumed = chargers
+
+    crashed.soc = 30
+    crashed.checkpoint.start(battery=crashed.battery)
+    crashed.vset(battery_params['VoltageMax'])
+    crashed.iset(battery_params['CChargeMax'] * battery_params['Capacity'])
+    crashed.psu.output_on()
+    for _ in range(samples):
+        crashed.read_output()
+        crashed.battery_voltage = crashed.voltage
+        crashed.update_data()
+    crashed.checkpoint.snapshot()
+    crashed.psu.output_off()
+
+    assert resumed.checkpoint.exists()
+    assert resumed.resume_session()
+    assert resumed.current_history == crashed.current_history
+    assert resumed.time_history == crashed.time_history
+    assert len(resumed.history) == len(crashed.history)
+    assert np.array_equal(resumed.history.resolution(100)[1],
+                          crashed.history.resolution(100)[1])
+    assert abs(resumed.ampere_hours - crashed.ampere_hours) < 1e-9
+    resumed.checkpoint.close()
+    print(f'Resumed {samples} samples and {1000 * resumed.ampere_hours:.3f}'
+          f'mAh')
+
+
 if __name__ == '__main__':
     pass
@@ -0,0 +1,376 @@
+import argparse
+import contextlib
+import functools
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import yaml
+
+import PSU
+import battery_charger
+from sample_history import DecimatedHistory
+from simulated_psu import SimulatedSerial
+
+
+BASELINE_FILE = 'Data/benchmark_baseline.json'
+# Settings turning off everything running beside the charge loop
+QUIET_CHARGE_PARAMS = {'CheckpointDir': None, 'SampleRate': None,
+                       'Termination': None, 'Watchdog': None,
+                       'SessionDB': None}
+
+
+def time_calls(function, repeats):
+    """
+    Times a function.
+
+    Parameters
+    ----------
+    function : callable
+        Called without arguments.
+    repeats : int
+
+    Returns
+    -------
+    list[float]
+        Seconds of every call.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def result(times, sim=None, calls=None):
+    """
+    Parameters
+    ----------
+    times : list[float]
+        Seconds of every call.
+    sim : simulated_psu.SimulatedSerial or None
+        The loop-back device, to count the commands and replies.
+    calls : int or None
+        Calls the counts of the device are shared by. None is len(times).
+
+    Returns
+    -------
+    dict
+        Median and min seconds, and commands and queries per call.
+    """
+    row = {'Seconds': statistics.median(times), 'Min': min(times),
+           'Commands': None, 'Queries': None}
+    if sim is not None:
+        calls = calls or len(times)
+        row['Commands'] = sim.commands / calls
+        row['Queries'] = sim.queries / calls
+    return row
+
+
+def loop_back_psu(battery_params, soc=30):
+    """
+    Opens a PSU on a simulated device answering at once, with no wait
+    between commands, so the times are those of the code.
+
+    Parameters
+    ----------
+    battery_params : dict
+    soc : float
+
+    Returns
+    -------
+    PSU.PSU
+    simulated_psu.SimulatedSerial
+    """
+    sim = SimulatedSerial(battery_params, soc=soc)
+    with contextlib.redirect_stdout(io.StringIO()):
+        psu = PSU.PSU(sim, serial_wait_time=0.0)
+    return psu, sim
+
+
+def bench_charge_update(battery_params, repeats, battery='Ronda-Li-Ion'):
+    """
+    One charge_update of a charger set up on the loop-back device. The
+    settling wait of find_voltage_battery is left out.
+
+    Parameters
+    ----------
+    battery_params : dict
+    repeats : int
+    battery : str
+        The battery of battery_params, so the charger uses the same one.
+
+    Returns
+    -------
+    dict
+    """
+    psu, sim = loop_back_psu(battery_params)
+    psu.find_voltage_battery = functools.partial(psu.find_voltage_battery,
+                                                 wait_for_measurement=0.0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        charger = battery_charger.BatteryCharger(
+            interactive=False,
+            charge_params=dict(QUIET_CHARGE_PARAMS, Battery=battery), psu=psu)
+        charger.charge_setup_high_level()
+    sim.commands = sim.queries = 0
+    times = time_calls(charger.charge_update, repeats)
+    psu.output_off()
+    return result(times, sim)
+
+
+def bench_follow_csv_step(battery_params, steps):
+    """
+    One step of follow_csv, from a sequence of zero length steps changing
+    both set-points every step.
+
+    Parameters
+    ----------
+    battery_params : dict
+    steps : int
+
+    Returns
+    -------
+    dict
+    """
+    psu, sim = loop_back_psu(battery_params)
+    psu.df = pd.DataFrame({'Step': np.arange(1, steps + 1),
+                           'Uset(V)': np.where(np.arange(steps) % 2, 3.0,
+                                               3.5),
+                           'Iset(A)': np.where(np.arange(steps) % 2, 0.1,
+                                               0.2),
+                           'Duration(s)': np.zeros(steps)})
+    sim.commands = sim.queries = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        psu.follow_csv()
+        seconds = time.perf_counter() - start
+    psu.output_off()
+    return result([seconds / steps], sim, steps)
+
+
+def histories(samples):
+    """
+    Makes charge histories like those of BatteryCharger.
+
+    Parameters
+    ----------
+    samples : int
+
+    Returns
+    -------
+    tuple[list]
+        Current, voltage, time and battery voltage histories.
+    """
+    start = datetime(2024, 1, 1)
+    time_history = [start + timedelta(seconds=i) for i in range(samples)]
+    current_history = np.linspace(0.6, 0.03, samples).tolist()
+    voltage_history = np.linspace(3.4, 3.65, samples).tolist()
+    battery_voltage_history = np.linspace(3.2, 3.6, samples).tolist()
+    return current_history, voltage_history, time_history, \
+        battery_voltage_history
+
+
+def bench_amount_charged(history, repeats):
+    """
+    Parameters
+    ----------
+    history : tuple[list]
+        From histories.
+    repeats : int
+
+    Returns
+    -------
+    dict
+    """
+    current_history, voltage_history, time_history, _ = history
+    return result(time_calls(lambda: battery_charger.amount_charged(
+        current_history, voltage_history, time_history), repeats))
+
+
+def bench_save_data_csv(history, repeats):
+    """
+    Parameters
+    ----------
+    history : tuple[list]
+        From histories.
+    repeats : int
+
+    Returns
+    -------
+    dict
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'benchmark.csv')
+        return result(time_calls(lambda: battery_charger.save_data_csv(
+            *history, filename), repeats))
+
+
+def bench_plot(history, repeats, max_points=2000):
+    """
+    One refresh of the plot, as BatteryCharger.plot and the file renderer
+    do it: the decimated history, the figure and a png.
+
+    Parameters
+    ----------
+    history : tuple[list]
+        From histories.
+    repeats : int
+    max_points : int
+
+    Returns
+    -------
+    dict
+    """
+    current_history, voltage_history, time_history, \
+        battery_voltage_history = history
+    decimated = DecimatedHistory(3)
+    for time_stamp, values in zip(time_history, zip(
+            current_history, voltage_history, battery_voltage_history)):
+        decimated.append(battery_charger.naive_seconds(time_stamp),
+                         values)
+
+    def refresh():
+        times, values = decimated.resolution(max_points)
+        times = (times * 1e6).astype('datetime64[us]')
+        fig = battery_charger.make_figure(50, values[:, 0], values[:, 1],
+                                          times, values[:, 2], (0.5, 6000.0))
+        fig.savefig(io.BytesIO(), format='png')
+
+    return result(time_calls(refresh, repeats))
+
+
+def run_benchmarks(repeats=20, samples=1000000, battery='Ronda-Li-Ion'):
+    """
+    Runs all the benchmarks.
+
+    Parameters
+    ----------
+    repeats : int
+        Calls of every benchmark. The ones on 10^6 samples are called a
+        tenth as many times.
+    samples : int
+        Samples of the histories.
+    battery : str
+        Battery in Config/battery_params.yml.
+
+    Returns
+    -------
+    dict
+        The results by benchmark, and Info on the machine.
+    """
+    with open('Config/battery_params.yml', 'r') as file:
+        battery_params = yaml.safe_load(file)[battery]
+    history = histories(samples)
+    slow_repeats = max(repeats // 10, 1)
+    results = {
+        'charge_update': bench_charge_update(battery_params, repeats,
+                                             battery),
+        'follow_csv_step': bench_follow_csv_step(battery_params,
+                                                 10 * repeats),
+        'amount_charged': bench_amount_charged(history, slow_repeats),
+        'save_data_csv': bench_save_data_csv(history, slow_repeats),
+        'plot_refresh': bench_plot(history, slow_repeats),
+    }
+    results['Info'] = {'Python': platform.python_version(),
+                       'Machine': platform.platform(),
+                       'Samples': samples,
+                       'Time': datetime.now().isoformat(timespec='seconds')}
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compares results with a baseline. A benchmark regressed if its median
+    time is more than tolerance slower, or it talks more to the PSU.
+
+    Parameters
+    ----------
+    results : dict
+    baseline : dict
+    tolerance : float
+        Allowed relative slowdown.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per benchmark.
+    list[str]
+        The regressions.
+    """
+    rows = []
+    regressions = []
+    for name, row in results.items():
+        if name == 'Info' or name not in baseline:
+            continue
+        old = baseline[name]
+        ratio = row['Seconds'] / old['Seconds']
+        rows.append({'Benchmark': name, 'Baseline(ms)': 1000 * old['Seconds'],
+                     'Now(ms)': 1000 * row['Seconds'], 'Ratio': ratio,
+                     'Commands': row['Commands'],
+                     'Baseline commands': old['Commands']})
+        if ratio > 1 + tolerance:
+            regressions.append(f'{name} is {ratio:.2f} times slower')
+        for count in ('Commands', 'Queries'):
+            if row[count] is not None and old[count] is not None and \
+                    row[count] > old[count]:
+                regressions.append(f'{name}: {count.lower()} per call went '
+                                   f'from {old[count]:g} to '
+                                   f'{row[count]:g}')
+    return pd.DataFrame(rows), regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Times the charge loop and data handling against a '
+                    'simulated PSU.')
+    parser.add_argument('--save', action='store_true',
+                        help='Save the results as the baseline')
+    parser.add_argument('--compare', action='store_true',
+                        help='Compare with the baseline, exits with 1 on '
+                             'regressions')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--samples', type=int, default=1000000)
+    parser.add_argument('--battery', default='Ronda-Li-Ion')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.repeats, args.samples, args.battery)
+    df = pd.DataFrame({name: row for name, row in results.items()
+                       if name != 'Info'}).T
+    df['Seconds'] *= 1000
+    df['Min'] *= 1000
+    print(df.rename(columns={'Seconds': 'Median(ms)', 'Min': 'Min(ms)'})
+          .to_string())
+
+    if args.save:
+        directory = os.path.dirname(args.baseline)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f'Baseline saved to {args.baseline}')
+
+    if args.compare:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        df, regressions = compare(results, baseline, args.tolerance)
+        print(df.to_string(index=False))
+        for regression in regressions:
+            print(f'Regression: {regression}')
+        if regressions:
+            sys.exit(1)
+        print('No regressions')
+
+
+if __name__ == '__main__':
+    main()
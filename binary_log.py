@@ -0,0 +1,337 @@
+import argparse
+import glob
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+
+
+MAGIC = b'PS3005BL'
+VERSION = 1
+# Magic, version, number of channels, number of rows, index stride
+HEADER = struct.Struct('<8sHHQI')
+NAME_SIZE = 32
+CHANNELS = ('Current', 'Charge Voltage', 'Battery Voltage')
+
+
+def padded(size):
+    """
+    Rounds a size up to a multiple of 8 bytes.
+
+    Parameters
+    ----------
+    size : int
+
+    Returns
+    -------
+    int
+    """
+    return (size + 7) // 8 * 8
+
+
+def to_seconds(time_history):
+    """
+    Converts times to the float64 seconds used in the files: seconds since
+    1970-01-01 of the times as they are, so local times stay local times as
+    in the csv files.
+
+    Parameters
+    ----------
+    time_history : list[datetime] or numpy.ndarray
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    if isinstance(time_history, np.ndarray) and \
+            np.issubdtype(time_history.dtype, np.datetime64):
+        times = time_history
+    else:
+        # Much faster than numpy for a list of datetimes
+        times = pd.to_datetime(time_history).to_numpy()
+    return (times - np.datetime64(0, 'us')) / np.timedelta64(1, 's')
+
+
+def write_binary_log(filename, times, channels, index_stride=4096):
+    """
+    Writes a binary columnar log.
+
+    The file is a header, the channel names, the float64 times, one
+    float32 column per channel and a sparse index holding every
+    index_stride-th time. Every section starts on 8 bytes.
+
+    Parameters
+    ----------
+    filename : str
+    times : numpy.ndarray
+        Increasing times in seconds.
+    channels : dict[str, numpy.ndarray]
+        The columns by name.
+    index_stride : int
+        Rows between the entries of the sparse index.
+
+    Returns
+    -------
+
+    """
+    times = np.ascontiguousarray(times, dtype='<f8')
+    n_rows = len(times)
+    temporary_file = filename + '.tmp'
+    with open(temporary_file, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(channels), n_rows,
+                               index_stride))
+        for name in channels:
+            encoded = name.encode()
+            if len(encoded) > NAME_SIZE:
+                raise ValueError(f'Channel name too long: {name}')
+            file.write(encoded.ljust(NAME_SIZE, b'\0'))
+        file.write(b'\0' * (padded(file.tell()) - file.tell()))
+
+        times.tofile(file)
+        for name, column in channels.items():
+            column = np.ascontiguousarray(column, dtype='<f4')
+            if len(column) != n_rows:
+                raise ValueError(f'{name} has {len(column)} rows, not '
+                                 f'{n_rows}')
+            column.tofile(file)
+            file.write(b'\0' * (padded(file.tell()) - file.tell()))
+        times[::index_stride].tofile(file)
+    os.replace(temporary_file, filename)
+
+
+class BinaryLog:
+    """
+    Class reading a binary columnar log. The file is memory-mapped and all
+    the arrays given are views of it, so nothing is read before it is used.
+
+    Methods
+    -------
+    __init__
+    __len__
+    find
+    time_range
+    datetimes
+    close
+    """
+
+    def __init__(self, filename):
+        """
+        Parameters
+        ----------
+        filename : str
+
+        Attributes
+        ----------
+        self.times : numpy.ndarray
+            The float64 times.
+        self.channels : dict[str, numpy.ndarray]
+            The float32 columns by name.
+        self.index : numpy.ndarray
+            Every index_stride-th time.
+        """
+        self.filename = filename
+        self.data = np.memmap(filename, dtype=np.uint8, mode='r')
+        magic, version, n_channels, n_rows, self.index_stride = \
+            HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            raise ValueError(f'{filename} is not a binary log.')
+        if version != VERSION:
+            raise ValueError(f'{filename} has version {version}, not '
+                             f'{VERSION}.')
+
+        offset = HEADER.size
+        names = []
+        for _ in range(n_channels):
+            names.append(bytes(self.data[offset:offset + NAME_SIZE])
+                         .rstrip(b'\0').decode())
+            offset += NAME_SIZE
+        offset = padded(offset)
+
+        self.times = self.data[offset:offset + 8 * n_rows].view('<f8')
+        offset += 8 * n_rows
+        self.channels = {}
+        for name in names:
+            self.channels[name] = self.data[offset:offset + 4 * n_rows] \
+                .view('<f4')
+            offset = padded(offset + 4 * n_rows)
+        n_index = -(-n_rows // self.index_stride)
+        self.index = self.data[offset:offset + 8 * n_index].view('<f8')
+
+    def __len__(self):
+        return len(self.times)
+
+    def find(self, time_s):
+        """
+        Finds the first row at or after a time. Only the block of rows the
+        sparse index points to is searched.
+
+        Parameters
+        ----------
+        time_s : float
+            Seconds, as in to_seconds.
+
+        Returns
+        -------
+        int
+            The row.
+        """
+        block = int(np.searchsorted(self.index, time_s, side='left'))
+        if block == 0:
+            return 0
+        start = (block - 1) * self.index_stride
+        stop = min(block * self.index_stride, len(self.times))
+        return start + int(np.searchsorted(self.times[start:stop], time_s,
+                                           side='left'))
+
+    def time_range(self, start=None, end=None):
+        """
+        Gives the rows from start up to, not including, end.
+
+        Parameters
+        ----------
+        start : float, datetime or None
+            First time. None starts at the beginning.
+        end : float, datetime or None
+            Time after the last row. None goes to the end.
+
+        Returns
+        -------
+        numpy.ndarray
+            The times.
+        dict[str, numpy.ndarray]
+            The columns by name.
+        """
+        first = 0 if start is None else self.find(as_seconds(start))
+        last = len(self.times) if end is None else self.find(as_seconds(end))
+        return self.times[first:last], {name: column[first:last] for
+                                        name, column in
+                                        self.channels.items()}
+
+    @staticmethod
+    def datetimes(times):
+        """
+        Converts times from the file back to datetime64.
+
+        Parameters
+        ----------
+        times : numpy.ndarray
+
+        Returns
+        -------
+        numpy.ndarray
+        """
+        return (times * 1e6).astype('datetime64[us]')
+
+    def close(self):
+        """
+        Releases the memory map. Views given earlier must not be used.
+
+        Returns
+        -------
+
+        """
+        self.data._mmap.close()
+
+
+def as_seconds(time_value):
+    """
+    Parameters
+    ----------
+    time_value : float or datetime
+
+    Returns
+    -------
+    float
+        Seconds, as in to_seconds.
+    """
+    if isinstance(time_value, (int, float)):
+        return float(time_value)
+    return float(to_seconds([time_value])[0])
+
+
+def save_data_binary(current_history, voltage_history, time_history,
+                     battery_voltage_history, filename):
+    """
+    Saves the histories in the binary log format, like save_data_csv.
+
+    Parameters
+    ----------
+    current_history : list[float]
+        A list of charging currents.
+    voltage_history : list[float]
+        A list of charging voltages.
+    time_history : list[datetime]
+        A list of times for measurements.
+    battery_voltage_history : list[float]
+        A list of battery voltages.
+    filename : str
+        Name and or location of the file
+
+    Returns
+    -------
+
+    """
+    write_binary_log(filename, to_seconds(time_history),
+                     dict(zip(CHANNELS, (current_history, voltage_history,
+                                         battery_voltage_history))))
+
+
+def convert_csv(csv_file, binary_file=None):
+    """
+    Converts a csv file written by save_data_csv to a binary log.
+
+    Parameters
+    ----------
+    csv_file : str
+    binary_file : str or None
+        None uses the csv name with .bin.
+
+    Returns
+    -------
+    str
+        The binary file.
+    """
+    if binary_file is None:
+        binary_file = os.path.splitext(csv_file)[0] + '.bin'
+    df = pd.read_csv(csv_file, usecols=('Time',) + CHANNELS)
+    write_binary_log(binary_file,
+                     to_seconds(pd.to_datetime(df['Time']).to_numpy()),
+                     {name: df[name].to_numpy() for name in CHANNELS})
+    return binary_file
+
+
+def convert_archive(pattern='Data/*.csv'):
+    """
+    Converts every csv file matching the pattern which has no newer binary
+    log next to it.
+
+    Parameters
+    ----------
+    pattern : str
+
+    Returns
+    -------
+    list[str]
+        The binary files written.
+    """
+    written = []
+    for csv_file in sorted(glob.glob(pattern)):
+        binary_file = os.path.splitext(csv_file)[0] + '.bin'
+        if os.path.exists(binary_file) and \
+                os.path.getmtime(binary_file) >= os.path.getmtime(csv_file):
+            continue
+        try:
+            written.append(convert_csv(csv_file, binary_file))
+        except ValueError as error:
+            print(f'Skipped {csv_file}: {error}')
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Converts save_data_csv files to binary logs.')
+    parser.add_argument('pattern', nargs='?', default='Data/*.csv')
+    args = parser.parse_args()
+    for converted in convert_archive(args.pattern):
+        print(converted)
@@ -0,0 +1,242 @@
+import os
+import re
+import threading
+
+import yaml
+
+
+class Driver:
+    """
+    Class describing one PSU model: how to recognise it from *IDN?, its
+    limits, the format of the values and the timing it needs. The commands
+    for every channel are made once here.
+
+    Methods
+    -------
+    __init__
+    matches
+    format_voltage
+    format_current
+    """
+
+    def __init__(self, name, idn_pattern, channels=1, voltage_max=30.0,
+                 current_max=5.0, voltage_format='{:05.2f}',
+                 current_format='{:05.3f}', serial_wait_time=0.05,
+                 output_on=b'OUTPUT1', output_off=b'OUTPUT0'):
+        """
+        Parameters
+        ----------
+        name : str
+            Name of the model, used in the cache.
+        idn_pattern : bytes
+            Regular expression matched against the *IDN? reply.
+        channels : int
+            Number of output channels.
+        voltage_max : float
+            Highest voltage of a channel in volts.
+        current_max : float
+            Highest current of a channel in amperes.
+        voltage_format : str
+            Fixed width format of the voltage values.
+        current_format : str
+            Fixed width format of the current values.
+        serial_wait_time : float
+            The time between sent commands the model needs.
+        output_on : bytes
+            Command turning the output on.
+        output_off : bytes
+            Command turning the output off.
+
+        Attributes
+        ----------
+        self.commands : dict[int, dict[str, bytes]]
+            The commands of every channel.
+        """
+        self.name = name
+        self.idn_regex = re.compile(idn_pattern, re.IGNORECASE)
+        self.channels = channels
+        self.voltage_max = voltage_max
+        self.current_max = current_max
+        self.voltage_format = voltage_format
+        self.current_format = current_format
+        self.serial_wait_time = serial_wait_time
+
+        self.commands = {}
+        for channel in range(1, channels + 1):
+            number = str(channel).encode()
+            self.commands[channel] = {
+                'vset': b'VSET' + number + b':',
+                'iset': b'ISET' + number + b':',
+                'get_vset': b'VSET' + number + b'?',
+                'get_iset': b'ISET' + number + b'?',
+                'vout': b'VOUT' + number + b'?',
+                'iout': b'IOUT' + number + b'?',
+                'output_on': output_on,
+                'output_off': output_off,
+                'status': b'STATUS?'}
+
+    def matches(self, identification):
+        """
+        Checks if an *IDN? reply is from this model.
+
+        Parameters
+        ----------
+        identification : bytes
+
+        Returns
+        -------
+        bool
+        """
+        return self.idn_regex.search(identification) is not None
+
+    def format_voltage(self, value):
+        """
+        Parameters
+        ----------
+        value : float
+
+        Returns
+        -------
+        str
+            The fixed width voltage value.
+        """
+        return self.voltage_format.format(value)
+
+    def format_current(self, value):
+        """
+        Parameters
+        ----------
+        value : float
+
+        Returns
+        -------
+        str
+            The fixed width current value.
+        """
+        return self.current_format.format(value)
+
+
+# Only models known to use the commands and the three flag STATUS? reply
+# of the LABPS3005DN. The generic driver must be last since it matches
+# everything
+DRIVERS = [
+    Driver('Velleman LABPS3005DN', rb'VELLEMAN\s*LABPS3005D'),
+    Driver('Tekpower TP3005P', rb'TEK\s*POWER\s*TP3005P',
+           serial_wait_time=0.1),
+    Driver('Generic PS3005', rb'', serial_wait_time=0.1),
+]
+
+CACHE_FILE = 'Config/driver_cache.yml'
+# Several ports can be opened at once from different threads
+_cache_lock = threading.Lock()
+
+
+def get_driver(name):
+    """
+    Gives the driver with the name.
+
+    Parameters
+    ----------
+    name : str
+
+    Returns
+    -------
+    Driver
+    """
+    for driver in DRIVERS:
+        if driver.name == name:
+            return driver
+    raise ValueError(f'No driver named {name}.')
+
+
+def identify(identification):
+    """
+    Gives the driver of the model answering *IDN? with identification.
+
+    Parameters
+    ----------
+    identification : bytes
+
+    Returns
+    -------
+    Driver
+    """
+    for driver in DRIVERS:
+        if driver.matches(identification):
+            return driver
+
+
+def load_cache(cache_file=CACHE_FILE):
+    """
+    Loads the drivers found earlier for every port.
+
+    Parameters
+    ----------
+    cache_file : str
+
+    Returns
+    -------
+    dict
+        Port to a dict with Driver and Identification.
+    """
+    try:
+        with open(cache_file, 'r') as file:
+            return yaml.safe_load(file) or {}
+    except FileNotFoundError:
+        return {}
+
+
+def cached_driver(port, cache_file=CACHE_FILE):
+    """
+    Gives the driver and identification cached for a port. A driver name
+    that no longer exists is a cache miss, so the model is found again.
+
+    Parameters
+    ----------
+    port : str
+    cache_file : str
+
+    Returns
+    -------
+    tuple[Driver, bytes] or None
+        None if the port is not cached.
+    """
+    entry = load_cache(cache_file).get(port)
+    if entry is None:
+        return None
+    try:
+        driver = get_driver(entry['Driver'])
+    except ValueError:
+        return None
+    return driver, entry['Identification'].encode()
+
+
+def cache_driver(port, driver, identification, cache_file=CACHE_FILE):
+    """
+    Stores the driver and identification found on a port.
+
+    Parameters
+    ----------
+    port : str
+    driver : Driver or None
+        None removes the port from the cache.
+    identification : bytes or None
+    cache_file : str
+
+    Returns
+    -------
+
+    """
+    with _cache_lock:
+        cache = load_cache(cache_file)
+        if driver is None:
+            if cache.pop(port, None) is None:
+                return
+        else:
+            cache[port] = {'Driver': driver.name,
+                           'Identification': identification.decode(
+                               errors='replace').strip()}
+        temporary_file = f'{cache_file}.{os.getpid()}.tmp'
+        with open(temporary_file, 'w') as file:
+            yaml.safe_dump(cache, file)
+        os.replace(temporary_file, cache_file)
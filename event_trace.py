@@ -0,0 +1,171 @@
+import itertools
+import json
+import os
+import signal
+import threading
+import time
+from datetime import datetime
+
+
+class EventTrace:
+    """
+    Class keeping the last events, like commands, replies, set-points and
+    SOC changes, in a fixed size ring in memory, to be dumped to a file when
+    something goes wrong.
+
+    Recording an event only stores a tuple in a preallocated list. The
+    sequence numbers come from itertools.count, which is atomic, so threads
+    can record without a lock. Everything else is done when dumping.
+
+    Methods
+    -------
+    __init__
+    record
+    events
+    dump
+    install_signal_handlers
+    restore_signal_handlers
+    """
+
+    def __init__(self, size=4096, directory='Data/Trace'):
+        """
+        Parameters
+        ----------
+        size : int
+            Number of events kept.
+        directory : str
+            Where dump puts the files.
+        """
+        self.size = size
+        self.directory = directory
+        self.ring = [None] * size
+        self.counter = itertools.count()
+        # Converts perf_counter times to posix times when dumping
+        self.time_offset = time.time() - time.perf_counter()
+        self.previous_handlers = {}
+
+    def record(self, kind, *data):
+        """
+        Records an event.
+
+        Parameters
+        ----------
+        kind : str
+            The type of event, like 'write', 'reply', 'setpoint' or 'soc'.
+        data
+            The values of the event. Bytes are decoded when dumping.
+
+        Returns
+        -------
+
+        """
+        number = next(self.counter)
+        self.ring[number % self.size] = (number, time.perf_counter(), kind,
+                                         data)
+
+    def events(self):
+        """
+        Gives the events kept, oldest first.
+
+        Returns
+        -------
+        list[dict]
+            Number, Time (posix), Kind and Data of every event.
+        """
+        events = sorted(event for event in list(self.ring)
+                        if event is not None)
+        return [{'Number': number, 'Time': self.time_offset + time_s,
+                 'Kind': kind, 'Data': [to_json(value) for value in data]}
+                for number, time_s, kind, data in events]
+
+    def dump(self, reason=''):
+        """
+        Writes the events kept to a json lines file in the directory. The
+        first line tells why.
+
+        Parameters
+        ----------
+        reason : str
+
+        Returns
+        -------
+        str
+            The file.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        filename = os.path.join(
+            self.directory,
+            f'trace_{datetime.now().strftime("%Y%m%d_%H%M%S_%f")}.jsonl')
+        temporary_file = filename + '.tmp'
+        with open(temporary_file, 'w') as file:
+            file.write(json.dumps({'Reason': reason,
+                                   'Time': time.time()}) + '\n')
+            for event in self.events():
+                file.write(json.dumps(event) + '\n')
+        os.replace(temporary_file, filename)
+        print(f'Trace saved to {filename}')
+        return filename
+
+    def install_signal_handlers(self, signals=(signal.SIGINT,
+                                               signal.SIGTERM)):
+        """
+        Dumps the trace when the process gets one of the signals, and then
+        lets the old handler have it. Only possible from the main thread,
+        elsewhere nothing is done.
+
+        Parameters
+        ----------
+        signals : tuple
+
+        Returns
+        -------
+        bool
+            If the handlers were installed.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return False
+        for signal_number in signals:
+            self.previous_handlers[signal_number] = signal.signal(
+                signal_number, self._handle_signal)
+        return True
+
+    def restore_signal_handlers(self):
+        """
+        Puts back the handlers replaced by install_signal_handlers.
+
+        Returns
+        -------
+
+        """
+        for signal_number, handler in self.previous_handlers.items():
+            signal.signal(signal_number, handler)
+        self.previous_handlers = {}
+
+    def _handle_signal(self, signal_number, frame):
+        self.record('signal', signal.Signals(signal_number).name)
+        self.dump(f'Signal {signal.Signals(signal_number).name}')
+        previous = self.previous_handlers.get(signal_number, signal.SIG_DFL)
+        if callable(previous):
+            previous(signal_number, frame)
+        elif previous == signal.SIG_DFL:
+            self.restore_signal_handlers()
+            signal.raise_signal(signal_number)
+
+
+def to_json(value):
+    """
+    Parameters
+    ----------
+    value
+        A value of an event.
+
+    Returns
+    -------
+    object
+        The value as something json can write.
+    """
+    if isinstance(value, bytes):
+        return value.decode(errors='replace')
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return repr(value)
@@ -1,10 +1,13 @@
 import PSU
 import battery_charger
+import pack_probe
+from session_checkpoint import SessionCheckpoint
 
 
 def interface():
     print("Options:\n0 = Quit\n1 = Follow CSV\n2 = Battery Charger"
-          "\n3 = Voltage of Battery\n4 = Free commands PSU\n")
+          "\n3 = Voltage of Battery\n4 = Free commands PSU"
+          "\n5 = Voltage of Batteries on all Ports\n")
     mode = input("Select one:\n")
 
     try:
@@ -17,10 +20,19 @@ def interface():
     if mode == 1:
         psu = PSU.PSU(input('PORT: '))
         psu.load_csv(input('CSV-file: '))
-        psu.follow_csv(int(input('Number of repetitions: ')))
+        repetitions = int(input('Number of repetitions: '))
+        sample_rate = input('Samples per second (empty for none): ')
+        if sample_rate:
+            log = SessionCheckpoint(input('Log folder: '))
+            psu.follow_csv(repetitions, float(sample_rate), log)
+        else:
+            psu.follow_csv(repetitions)
         psu.close_serial()
     if mode == 2:
         batcha = battery_charger.BatteryCharger()
+        if batcha.checkpoint is not None and batcha.checkpoint.exists():
+            if input('Resume unfinished session (y, n_): ').lower() == 'y':
+                batcha.resume_session()
         batcha.charge()
         batcha.end()
     if mode == 3:
@@ -32,6 +44,10 @@ def interface():
     if mode == 4:
         psu = PSU.PSU(input('PORT: '))
         psu.write_serial_continually()
+    if mode == 5:
+        csv_file = input('CSV-file (empty for none): ')
+        df = pack_probe.probe_configured_ports(csv_file or None)
+        print(df.to_string())
 
 
 if __name__ == '__main__':
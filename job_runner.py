@@ -0,0 +1,306 @@
+import argparse
+import os
+import threading
+import time
+
+import pandas as pd
+import yaml
+
+import PSU
+import battery_charger
+from session_checkpoint import SessionCheckpoint
+
+
+JOB_TYPES = ('sequence', 'charge', 'probe')
+CHARGE_OPTIONS = ('Type', 'Port', 'Plotting', 'SaveData')
+
+
+def load_jobs(job_file):
+    """
+    Loads a job file. See Config/jobs_example.yml.
+
+    Parameters
+    ----------
+    job_file : str
+
+    Returns
+    -------
+    list[dict]
+        The jobs.
+    bool
+        If the ports run in parallel.
+    """
+    with open(job_file, 'r') as file:
+        content = yaml.safe_load(file)
+    return content['Jobs'], content.get('Parallel', False)
+
+
+def charge_settings(job, charge_params):
+    """
+    Gives the settings of a charge job overriding charge_params.yml. Every
+    port gets its own checkpoint directory inside CheckpointDir, unless the
+    job sets one, so charges on different ports do not share a journal.
+
+    Parameters
+    ----------
+    job : dict
+    charge_params : dict
+        The content of charge_params.yml.
+
+    Returns
+    -------
+    dict
+    """
+    settings = {key: value for key, value in job.items()
+                if key not in CHARGE_OPTIONS}
+    settings['Port'] = job['Port']
+    if 'CheckpointDir' not in job and \
+            charge_params.get('CheckpointDir') is not None:
+        settings['CheckpointDir'] = os.path.join(
+            charge_params['CheckpointDir'], os.path.basename(job['Port']))
+    return settings
+
+
+def validate_jobs(jobs, parallel=False):
+    """
+    Checks all jobs before any of them runs, so a mistake in the last job
+    does not stop the queue halfway through the night.
+
+    In parallel, charge jobs on different ports must not share a checkpoint
+    directory, and their data files must have {port} in the name.
+
+    Parameters
+    ----------
+    jobs : list[dict]
+    parallel : bool
+
+    Returns
+    -------
+
+    """
+    with open('Config/battery_params.yml', 'r') as file:
+        battery_params = yaml.safe_load(file)
+    with open('Config/charge_params.yml', 'r') as file:
+        charge_params = yaml.safe_load(file)
+
+    errors = []
+    # Files of the charge jobs, and the first job and port using them
+    charge_files = {}
+    for number, job in enumerate(jobs, 1):
+        job_type = job.get('Type')
+        if job_type not in JOB_TYPES:
+            errors.append(f'Job {number}: Type must be one of {JOB_TYPES}, '
+                          f'not {job_type}.')
+            continue
+        if not isinstance(job.get('Port'), str):
+            errors.append(f'Job {number}: Port must be set.')
+
+        if job_type == 'sequence':
+            file = job.get('File')
+            if file is None or not os.path.isfile(file):
+                errors.append(f'Job {number}: File {file} does not exist.')
+            else:
+                columns = pd.read_csv(file, nrows=0).columns
+                missing = {'Uset(V)', 'Iset(A)', 'Duration(s)'} - \
+                    set(columns)
+                if missing:
+                    errors.append(f'Job {number}: {file} is missing '
+                                  f'{sorted(missing)}.')
+            repetitions = job.get('Repetitions', 1)
+            if not isinstance(repetitions, int) or repetitions < 1:
+                errors.append(f'Job {number}: Repetitions must be a positive '
+                              f'integer.')
+            sample_rate = job.get('SampleRate')
+            if sample_rate is not None and (
+                    not isinstance(sample_rate, (int, float)) or
+                    sample_rate <= 0):
+                errors.append(f'Job {number}: SampleRate must be positive.')
+            if sample_rate is not None and job.get('LogDir') is None:
+                errors.append(f'Job {number}: SampleRate needs a LogDir.')
+
+        if job_type == 'charge':
+            battery = job.get('Battery', charge_params['Battery'])
+            if battery not in battery_params:
+                errors.append(f'Job {number}: Unknown battery {battery}.')
+            elif battery_params[battery]['Capacity'] is None and \
+                    job.get('Capacity', charge_params['Capacity']) is None:
+                errors.append(f'Job {number}: Capacity is not set for '
+                              f'{battery}.')
+            unknown = set(job) - set(charge_params) - set(CHARGE_OPTIONS)
+            if unknown:
+                errors.append(f'Job {number}: Unknown settings '
+                              f'{sorted(unknown)}.')
+            settings = dict(charge_params)
+            settings.update(charge_settings(job, charge_params))
+            for key in ('CheckpointDir', 'CSVFile', 'BinaryFile'):
+                path = settings.get(key)
+                if not parallel or path is None or '{port}' in path:
+                    continue
+                first_number, first_port = charge_files.setdefault(
+                    (key, path), (number, job['Port']))
+                if first_port != job['Port']:
+                    errors.append(f'Job {number}: {key} {path} is also '
+                                  f'used by job {first_number} on '
+                                  f'{first_port} at the same time.')
+
+        if job_type == 'probe':
+            safe_voltage = job.get('SafeVoltage')
+            if not isinstance(safe_voltage, (int, float)) or \
+                    safe_voltage <= 0:
+                errors.append(f'Job {number}: SafeVoltage must be positive.')
+
+    if errors:
+        raise ValueError('Invalid jobs:\n' + '\n'.join(errors))
+
+
+def run_job(job, psu):
+    """
+    Runs one job on an open PSU.
+
+    Parameters
+    ----------
+    job : dict
+    psu : PSU.PSU
+
+    Returns
+    -------
+    str
+        A short result.
+    """
+    if job['Type'] == 'sequence':
+        psu.load_csv(job['File'])
+        log = None
+        if job.get('SampleRate') is not None:
+            log = SessionCheckpoint(job['LogDir'])
+        psu.follow_csv(job.get('Repetitions', 1), job.get('SampleRate'), log)
+        psu.output_off()
+        return f'{len(psu.df)} steps'
+
+    if job['Type'] == 'charge':
+        with open('Config/charge_params.yml', 'r') as file:
+            charge_params = yaml.safe_load(file)
+        charger = battery_charger.BatteryCharger(
+            interactive=False,
+            charge_params=charge_settings(job, charge_params), psu=psu)
+        charger.charge(job.get('Plotting', False), job.get('SaveData', True))
+        return f'{1000 * charger.ampere_hours:.0f}mAh, SOC {charger.soc}%'
+
+    battery_voltage = psu.find_voltage_battery(job['SafeVoltage'])
+    return f'{battery_voltage}V'
+
+
+def run_port(port, numbered_jobs, results):
+    """
+    Runs the jobs of one port one after another, keeping the port open
+    between them. A failing job turns the output off and the next job runs,
+    unless the watchdog tripped: then the output stays locked off and the
+    rest of the jobs on the port are skipped.
+
+    Parameters
+    ----------
+    port : str
+    numbered_jobs : list[tuple[int, dict]]
+    results : list[dict]
+        The results are appended here.
+
+    Returns
+    -------
+
+    """
+    psu = None
+    tripped = None
+    for number, job in numbered_jobs:
+        start = time.monotonic()
+        result = {'Job': number, 'Type': job['Type'], 'Port': port}
+        if tripped is not None:
+            result['Result'] = None
+            result['Error'] = f'Skipped, the watchdog tripped in job {tripped}'
+            result['Duration(s)'] = 0.0
+            print(f'Job {number} on {port}: {result["Error"]}')
+            results.append(result)
+            continue
+        try:
+            if psu is None:
+                psu = PSU.PSU(port)
+            result['Result'] = run_job(job, psu)
+            result['Error'] = None
+        except Exception as error:
+            result['Result'] = None
+            result['Error'] = f'{type(error).__name__}: {error}'
+            if psu is not None and psu.interlock is not None and \
+                    psu.interlock.is_set():
+                tripped = number
+            if psu is not None:
+                try:
+                    psu.output_off()
+                except Exception:
+                    # The port is broken, open it again for the next job
+                    psu.close_serial()
+                    psu = None
+        result['Duration(s)'] = time.monotonic() - start
+        print(f'Job {number} on {port}: {result["Error"] or result["Result"]}')
+        results.append(result)
+    if psu is not None:
+        psu.close_serial()
+
+
+def run_jobs(jobs, parallel=False):
+    """
+    Validates and runs jobs. Jobs on the same port always run in order. In
+    parallel every port has its own thread, otherwise the ports take turns
+    in the order of the first job on them.
+
+    Parameters
+    ----------
+    jobs : list[dict]
+    parallel : bool
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per job.
+    """
+    validate_jobs(jobs, parallel)
+    by_port = {}
+    for number, job in enumerate(jobs, 1):
+        by_port.setdefault(job['Port'], []).append((number, job))
+
+    results = []
+    if parallel:
+        threads = [threading.Thread(target=run_port,
+                                    args=(port, numbered_jobs, results))
+                   for port, numbered_jobs in by_port.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        for port, numbered_jobs in by_port.items():
+            run_port(port, numbered_jobs, results)
+    return pd.DataFrame(results).sort_values('Job').reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Runs a queue of sequence, charge and probe jobs '
+                    'without prompts.')
+    parser.add_argument('job_file')
+    parser.add_argument('--check', action='store_true',
+                        help='Only validate the jobs')
+    parser.add_argument('--output', default=None,
+                        help='csv file for the results')
+    args = parser.parse_args()
+
+    jobs, parallel = load_jobs(args.job_file)
+    if args.check:
+        validate_jobs(jobs, parallel)
+        print(f'{len(jobs)} jobs are valid')
+        return
+    df = run_jobs(jobs, parallel)
+    if args.output is not None:
+        df.to_csv(args.output, index=False)
+    print(df.to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import yaml
+
+import PSU
+from batch_analysis import soc_from_ocv
+
+
+def probe_port(port, safe_voltage, battery_params=None):
+    """
+    Measures the battery on one port with find_voltage_battery.
+
+    Parameters
+    ----------
+    port : str
+    safe_voltage : float
+        The voltage level set during the check.
+    battery_params : dict or None
+        The parameters of the battery, used for the SOC estimate.
+
+    Returns
+    -------
+    dict
+        Port, Identification, Voltage, SOC and Error.
+    """
+    result = {'Port': port, 'Identification': None, 'Voltage': None,
+              'SOC': None, 'Error': None}
+    try:
+        psu = PSU.PSU(port)
+    except Exception as error:
+        result['Error'] = f'{type(error).__name__}: {error}'
+        return result
+    try:
+        result['Identification'] = psu.identification.decode(
+            errors='replace').strip()
+        result['Voltage'] = psu.find_voltage_battery(safe_voltage)
+        if battery_params is not None:
+            result['SOC'] = float(soc_from_ocv(result['Voltage'],
+                                               battery_params))
+    except Exception as error:
+        result['Error'] = f'{type(error).__name__}: {error}'
+        try:
+            psu.output_off()
+        except Exception as off_error:
+            # The row of this port is kept, the other ports are unaffected
+            result['Error'] += f'. The output could not be turned off: ' \
+                               f'{off_error}'
+    finally:
+        psu.close_serial()
+    return result
+
+
+def probe_ports(ports, safe_voltage, battery_params=None, workers=None):
+    """
+    Measures the batteries on all ports at the same time. Every port has
+    its own worker thread, since the time is spent waiting for the PSUs.
+    The rows are printed as soon as they are done.
+
+    Parameters
+    ----------
+    ports : list[str]
+    safe_voltage : float
+        The voltage level set during the check.
+    battery_params : dict or None
+        The parameters of the battery, used for the SOC estimates.
+    workers : int or None
+        Maximum number of ports probed at once. None probes all at once.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per port, sorted by voltage.
+    """
+    rows = []
+    with ThreadPoolExecutor(max_workers=workers or len(ports)) as executor:
+        futures = [executor.submit(probe_port, port, safe_voltage,
+                                   battery_params) for port in ports]
+        for future in as_completed(futures):
+            row = future.result()
+            if row['Error'] is None:
+                soc = '' if row['SOC'] is None else f', {row["SOC"]:.0f}%'
+                print(f'{row["Port"]}: {row["Voltage"]}V{soc}')
+            else:
+                print(f'{row["Port"]}: {row["Error"]}')
+            rows.append(row)
+    return pd.DataFrame(rows).sort_values('Voltage').reset_index(drop=True)
+
+
+def probe_configured_ports(csv_file=None):
+    """
+    Probes the Ports of charge_params.yml with the limits and SOC table of
+    its Battery.
+
+    Parameters
+    ----------
+    csv_file : str or None
+        Where to save the table.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per port, sorted by voltage.
+    """
+    with open('Config/charge_params.yml', 'r') as file:
+        charge_params = yaml.safe_load(file)
+    with open('Config/battery_params.yml', 'r') as file:
+        battery_params = yaml.safe_load(file)[charge_params['Battery']]
+
+    df = probe_ports(charge_params['Ports'], battery_params['VoltageMax'],
+                     battery_params)
+    if csv_file is not None:
+        df.to_csv(csv_file, index=False)
+    return df
@@ -0,0 +1,175 @@
+import multiprocessing
+import os
+import queue
+import threading
+
+import battery_charger
+
+
+class PlotRenderer:
+    """
+    Class rendering the charge plots away from the charge control loop.
+
+    Snapshots are given to submit and rendered by a worker. Only the newest
+    snapshot waits for the worker, so if rendering is slower than the loop
+    the stale frames are dropped. submit never waits for the worker.
+
+    With a filename the worker is a thread saving PNG files without any GUI
+    backend. Without a filename the worker is a process showing a pyplot
+    window.
+
+    Methods
+    -------
+    __init__
+    start
+    submit
+    stop
+    """
+
+    def __init__(self, filename=None):
+        """
+        Parameters
+        ----------
+        filename : str or None
+            PNG file to write. It may contain {frame} for one file per
+            frame. None shows the plot in a window instead.
+
+        Attributes
+        ----------
+        self.submitted : int
+        self.dropped : int
+            Frames replaced by a newer one before they were rendered.
+        """
+        self.filename = filename
+        self.submitted = 0
+        self.dropped = 0
+        self.frames = None
+        self.worker = None
+
+    def start(self):
+        """
+        Starts the worker.
+
+        Returns
+        -------
+
+        """
+        if self.filename is not None:
+            self.frames = queue.Queue(maxsize=1)
+            self.worker = threading.Thread(target=render_loop,
+                                           args=(self.frames, self.filename),
+                                           daemon=True)
+        else:
+            self.frames = multiprocessing.Queue(maxsize=1)
+            self.worker = multiprocessing.Process(target=render_loop,
+                                                  args=(self.frames, None),
+                                                  daemon=True)
+        self.worker.start()
+
+    def submit(self, *args):
+        """
+        Gives a snapshot to the worker, replacing the waiting one if the
+        worker has not taken it yet.
+
+        Parameters
+        ----------
+        args
+            To battery_charger.make_figure. They must not be changed
+            afterwards, so give copies.
+
+        Returns
+        -------
+
+        """
+        self.submitted += 1
+        try:
+            self.frames.put_nowait(args)
+        except queue.Full:
+            try:
+                self.frames.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+            try:
+                self.frames.put_nowait(args)
+            except queue.Full:
+                self.dropped += 1
+
+    def stop(self, timeout=5):
+        """
+        Renders the last frame and stops the worker. Never waits longer
+        than the timeout, even if the worker is stuck or has died.
+
+        Parameters
+        ----------
+        timeout : float
+            Maximum time to wait for the worker.
+
+        Returns
+        -------
+
+        """
+        if self.worker is None:
+            return
+        if self.worker.is_alive():
+            try:
+                self.frames.put(None, timeout=timeout)
+            except queue.Full:
+                print('The plot worker is not responding')
+            else:
+                self.worker.join(timeout)
+        self.worker = None
+
+
+def render_loop(frames, filename):
+    """
+    The loop of the worker. Renders frames until it gets None. A frame
+    that fails to render is skipped and the error printed, once until a
+    different error happens.
+
+    Parameters
+    ----------
+    frames : queue.Queue or multiprocessing.Queue
+        Queue of arguments to battery_charger.make_figure.
+    filename : str or None
+        PNG file to write, or None to show a pyplot window.
+
+    Returns
+    -------
+
+    """
+    if filename is None:
+        import matplotlib.pyplot as plt
+        plt.ion()
+
+    frame_number = 0
+    fig = None
+    last_error = None
+    while True:
+        try:
+            frame = frames.get(timeout=0.1)
+        except queue.Empty:
+            if filename is None:
+                # Keeps the window responsive between frames
+                plt.pause(0.05)
+            continue
+        if frame is None:
+            break
+
+        try:
+            if filename is not None:
+                fig = battery_charger.make_figure(*frame)
+                path = filename.format(frame=frame_number)
+                temporary_path = path + '.tmp.png'
+                fig.savefig(temporary_path)
+                os.replace(temporary_path, path)
+            else:
+                if fig is not None:
+                    plt.close(fig)
+                fig = battery_charger.make_figure(*frame, pyplot=True)
+                plt.pause(0.001)
+        except Exception as error:
+            if repr(error) != last_error:
+                print(f'Plot not rendered: {error}')
+                last_error = repr(error)
+        frame_number += 1
@@ -0,0 +1,287 @@
+import numpy as np
+import pandas as pd
+
+
+class Profile:
+    """
+    Class holding a sequence of steps for PSU.follow_profile. A step is a
+    voltage, a current and a duration.
+
+    A profile is a list of parts, each an array triple or another profile,
+    with a number of repetitions. Adding and multiplying profiles only makes
+    new lists of parts, so the step arrays are shared and never copied. The
+    parts are walked without recursion, so a profile built by adding to it
+    in a loop can be any depth.
+
+    Methods
+    -------
+    __init__
+    __len__
+    __add__
+    __mul__
+    chunks
+    duration
+    to_arrays
+    to_csv
+    """
+
+    def __init__(self, parts=()):
+        """
+        Parameters
+        ----------
+        parts : sequence[tuple]
+            Pairs of (Profile or (voltage, current, duration), repetitions).
+        """
+        self.parts = list(parts)
+
+    def __len__(self):
+        return self._total(lambda part: len(part[2]))
+
+    def __add__(self, other):
+        return Profile([(self, 1), (other, 1)])
+
+    def __mul__(self, repetitions):
+        return Profile([(self, int(repetitions))])
+
+    __rmul__ = __mul__
+
+    def chunks(self):
+        """
+        Goes through the profile in order.
+
+        Yields
+        ------
+        tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]
+            Voltage, current and duration arrays.
+        """
+        stack = [self._repeated_parts()]
+        while stack:
+            part = next(stack[-1], None)
+            if part is None:
+                stack.pop()
+            elif isinstance(part, Profile):
+                stack.append(part._repeated_parts())
+            else:
+                yield part
+
+    def duration(self):
+        """
+        Gives the total duration.
+
+        Returns
+        -------
+        float
+            Seconds.
+        """
+        return float(self._total(lambda part: float(part[2].sum())))
+
+    def _repeated_parts(self):
+        for part, repetitions in self.parts:
+            for _ in range(repetitions):
+                yield part
+
+    def _total(self, value):
+        # Sums value over the step arrays, children before their parents
+        totals = {}
+        stack = [self]
+        while stack:
+            profile = stack[-1]
+            if id(profile) in totals:
+                stack.pop()
+                continue
+            pending = [part for part, _ in profile.parts
+                       if isinstance(part, Profile) and
+                       id(part) not in totals]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            totals[id(profile)] = sum(
+                (totals[id(part)] if isinstance(part, Profile)
+                 else value(part)) * repetitions
+                for part, repetitions in profile.parts)
+        return totals[id(self)]
+
+    def to_arrays(self):
+        """
+        Makes the whole profile into single arrays. This copies the steps.
+
+        Returns
+        -------
+        tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]
+            Voltage, current and duration arrays.
+        """
+        chunks = list(self.chunks())
+        if not chunks:
+            return np.empty(0), np.empty(0), np.empty(0)
+        return tuple(np.concatenate(column) for column in zip(*chunks))
+
+    def to_csv(self, file):
+        """
+        Saves the profile in the format of SequenceFile.csv.
+
+        Parameters
+        ----------
+        file : str
+
+        Returns
+        -------
+
+        """
+        voltage, current, duration = self.to_arrays()
+        df = pd.DataFrame({'Step': np.arange(1, len(duration) + 1),
+                           'Uset(V)': voltage, 'Iset(A)': current,
+                           'Duration(s)': duration})
+        df.to_csv(file, index=False)
+
+
+def steps(voltage, current, duration):
+    """
+    Makes a profile of given steps. Scalars are broadcast to the length of
+    the arrays.
+
+    Parameters
+    ----------
+    voltage : float or array_like
+    current : float or array_like
+    duration : float or array_like
+        Seconds of every step.
+
+    Returns
+    -------
+    Profile
+    """
+    voltage, current, duration = np.broadcast_arrays(
+        np.asarray(voltage, dtype=float), np.asarray(current, dtype=float),
+        np.asarray(duration, dtype=float))
+    if voltage.ndim == 0:
+        voltage, current, duration = voltage[None], current[None], \
+            duration[None]
+    if np.any(duration < 0):
+        raise ValueError('Durations must be positive.')
+    return Profile([((voltage, current, duration), 1)])
+
+
+def ramp(voltage_start, voltage_end, current_start, current_end, n_steps,
+         step_duration):
+    """
+    Makes a linear ramp of voltage and current.
+
+    Parameters
+    ----------
+    voltage_start : float
+    voltage_end : float
+    current_start : float
+    current_end : float
+    n_steps : int
+    step_duration : float
+        Seconds of every step.
+
+    Returns
+    -------
+    Profile
+    """
+    return steps(np.linspace(voltage_start, voltage_end, n_steps),
+                 np.linspace(current_start, current_end, n_steps),
+                 step_duration)
+
+
+def staircase(voltage_start, voltage_step, current_start, current_step,
+              n_steps, step_duration):
+    """
+    Makes a staircase, changing voltage and current by a fixed step.
+
+    Parameters
+    ----------
+    voltage_start : float
+    voltage_step : float
+    current_start : float
+    current_step : float
+    n_steps : int
+    step_duration : float
+        Seconds of every step.
+
+    Returns
+    -------
+    Profile
+    """
+    index = np.arange(n_steps)
+    return steps(voltage_start + index * voltage_step,
+                 current_start + index * current_step, step_duration)
+
+
+def pulse_train(voltage, current_high, current_low, time_high, time_low,
+                n_pulses):
+    """
+    Makes current pulses. Only one pulse is stored and repeated.
+
+    Parameters
+    ----------
+    voltage : float
+    current_high : float
+    current_low : float
+    time_high : float
+        Seconds at the high current.
+    time_low : float
+        Seconds at the low current.
+    n_pulses : int
+
+    Returns
+    -------
+    Profile
+    """
+    return steps(voltage, [current_high, current_low],
+                 [time_high, time_low]) * n_pulses
+
+
+def cc_cv(voltage, current, cutoff_current, cc_duration, time_constant,
+          step_duration):
+    """
+    Emulates a CC-CV charge with steps: the current is held for cc_duration
+    and then decays exponentially, as in the CV phase, until it reaches the
+    cutoff current.
+
+    Parameters
+    ----------
+    voltage : float
+        The charge voltage.
+    current : float
+        The constant current.
+    cutoff_current : float
+        Current ending the CV phase.
+    cc_duration : float
+        Seconds of the CC phase.
+    time_constant : float
+        Seconds for the current to fall to 1/e in the CV phase.
+    step_duration : float
+        Seconds of every CV step.
+
+    Returns
+    -------
+    Profile
+    """
+    n_steps = int(np.ceil(time_constant * np.log(current / cutoff_current)
+                          / step_duration))
+    times = np.arange(1, n_steps + 1) * step_duration
+    currents = np.maximum(current * np.exp(-times / time_constant),
+                          cutoff_current)
+    return steps(voltage, current, cc_duration) + \
+        steps(voltage, currents, step_duration)
+
+
+def from_csv(file='SequenceFile.csv'):
+    """
+    Makes a profile of a sequence file.
+
+    Parameters
+    ----------
+    file : str
+
+    Returns
+    -------
+    Profile
+    """
+    df = pd.read_csv(file)
+    return steps(df['Uset(V)'].to_numpy(dtype=float),
+                 df['Iset(A)'].to_numpy(dtype=float),
+                 df['Duration(s)'].to_numpy(dtype=float))
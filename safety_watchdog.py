@@ -0,0 +1,302 @@
+import random
+import statistics
+import threading
+import time
+
+import PSU
+from sampler import Sampler
+from simulated_psu import SimulatedSerial
+
+
+class Watchdog:
+    """
+    Class checking the PSU for faults on a short period in a background
+    thread: no reply, the OCP flag from STATUS?, the output voltage outside
+    its limits, and an open circuit (no current while the voltage is at
+    the set level, as when a cell comes off its holder).
+
+    On a fault it turns the output off at once and sets tripped, which the
+    charge loop waits on instead of sleeping, so the loop wakes up right
+    away. tripped is also the interlock of the PSU, so the output can not be
+    turned on again afterwards. A check is STATUS? and VOUT1?, plus IOUT1?
+    while the output is on.
+
+    Methods
+    -------
+    __init__
+    start
+    stop
+    check
+    trip
+    wait
+    """
+
+    def __init__(self, psu, voltage_max, voltage_min=None, period=0.5,
+                 open_circuit_checks=10):
+        """
+        Parameters
+        ----------
+        psu : PSU.PSU
+        voltage_max : float
+            Highest allowed output voltage.
+        voltage_min : float or None
+            Lowest allowed output voltage while the output is on.
+        period : float
+            Seconds between the start of two checks.
+        open_circuit_checks : int
+            Checks in a row with an open circuit before tripping. None
+            turns the open circuit check off.
+
+        Attributes
+        ----------
+        self.tripped : threading.Event
+        self.fault : str or None
+            What tripped the watchdog.
+        self.checks : int
+        """
+        self.psu = psu
+        self.voltage_max = voltage_max
+        self.voltage_min = voltage_min
+        self.period = period
+        self.open_circuit_checks = open_circuit_checks
+        self.tripped = threading.Event()
+        self.fault = None
+        self.checks = 0
+        self._open_circuit_count = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts checking.
+
+        Returns
+        -------
+
+        """
+        self.psu.interlock = self.tripped
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops checking.
+
+        Returns
+        -------
+
+        """
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def check(self):
+        """
+        Checks the PSU once. Any error talking to the PSU is a fault.
+
+        Returns
+        -------
+        str or None
+            The fault, or None if all is fine.
+        """
+        self.checks += 1
+        try:
+            status = self.psu.get_status()
+            if len(status) < 3:
+                return 'The PSU is not responding'
+            if status[2] == 49:
+                return 'Over current protection tripped'
+            voltage = self.psu.get_vout()
+            if voltage > self.voltage_max:
+                return f'Over-voltage: {voltage}V > {self.voltage_max}V'
+            if status[1] != 49:
+                self._open_circuit_count = 0
+                return None
+            if self.voltage_min is not None and voltage < self.voltage_min:
+                return f'Under-voltage: {voltage}V < {self.voltage_min}V'
+            if self.open_circuit_checks is not None:
+                current = self.psu.get_iout()
+                if current <= 0.0005 and self.psu.set_v is not None and \
+                        voltage >= self.psu.set_v - 0.02:
+                    self._open_circuit_count += 1
+                else:
+                    self._open_circuit_count = 0
+                if self._open_circuit_count >= self.open_circuit_checks:
+                    return 'Open circuit, the cell may be disconnected'
+        except (ValueError, IndexError):
+            return 'The PSU is not responding'
+        except Exception as error:
+            # Like a serial error from an unplugged cable
+            return f'Communication failed: {type(error).__name__}: {error}'
+        return None
+
+    def trip(self, fault):
+        """
+        Turns the output off, reads the status of the PSU back so it knows
+        the output is off, and wakes up whoever waits.
+
+        Parameters
+        ----------
+        fault : str
+
+        Returns
+        -------
+
+        """
+        self.psu.trace.record('trip', fault)
+        try:
+            self.psu.write_serial(self.psu.commands['output_off'])
+            self.psu.update_status()
+        except Exception as error:
+            fault += f'. The output could not be turned off: {error}'
+        self.fault = fault
+        self.tripped.set()
+        print(f'Watchdog: {fault}')
+
+    def wait(self, seconds):
+        """
+        Sleeps, but wakes up at once if the watchdog trips.
+
+        Parameters
+        ----------
+        seconds : float
+
+        Returns
+        -------
+        bool
+            If the watchdog tripped.
+        """
+        return self.tripped.wait(seconds)
+
+    def _run(self):
+        next_time = time.monotonic()
+        while not self.tripped.is_set():
+            fault = self.check()
+            if fault is not None:
+                self.trip(fault)
+                return
+            next_time += self.period
+            if self._stop_event.wait(max(next_time - time.monotonic(), 0)):
+                return
+
+
+def benchmark_reaction_time(trials=20, period=0.5, serial_wait_time=0.05,
+                            reply_latency=0.005, sample_rate=1.0,
+                            loop_period=2.0):
+    """
+    Measures the time from a fault in the simulated PSU until the watchdog
+    has turned the output off, for OCP and over-voltage faults injected at
+    random times. A sampler and a stand-in for the charge loop share the
+    port with the watchdog, as in a charge, and the share of the time the
+    port is busy is measured too.
+
+    Parameters
+    ----------
+    trials : int
+        Number of faults of each kind.
+    period : float
+        The watchdog period.
+    serial_wait_time : float
+        The time between sent commands of the PSU.
+    reply_latency : float
+        Seconds the simulated PSU takes to answer.
+    sample_rate : float or None
+        Samples per second of the sampler. None runs no sampler.
+    loop_period : float or None
+        Seconds between the set-point and voltage commands of the charge
+        loop. None runs no charge loop.
+
+    Returns
+    -------
+    dict[str, list[float]]
+        The reaction times in seconds for each kind of fault, and the port
+        load of every trial.
+    """
+    results = {'ocp': [], 'over-voltage': []}
+    port_load = []
+    for kind in results:
+        for _ in range(trials):
+            simulated = SimulatedSerial(reply_latency=reply_latency)
+            psu = PSU.PSU(simulated, serial_wait_time=serial_wait_time)
+            psu.iset(0.5)
+            psu.vset(4.2)
+            psu.output_on()
+            watchdog = Watchdog(psu, voltage_max=4.3, period=period,
+                                open_circuit_checks=None)
+            sampler = None
+            if sample_rate is not None:
+                sampler = Sampler(psu, sample_rate)
+            loop_stop = threading.Event()
+            loop = None
+            if loop_period is not None:
+                loop = threading.Thread(target=charge_loop_load,
+                                        args=(psu, loop_period, loop_stop),
+                                        daemon=True)
+            start = time.perf_counter()
+            commands = simulated.commands
+            queries = simulated.queries
+            watchdog.start()
+            for worker in (sampler, loop):
+                if worker is not None:
+                    worker.start()
+            time.sleep(random.uniform(2 * period, 4 * period))
+
+            fault_time = time.perf_counter()
+            if kind == 'ocp':
+                # The PSU itself turns off on OCP, so the reaction is the
+                # watchdog noticing it
+                simulated.inject_ocp()
+            else:
+                simulated.set_open_circuit_voltage(4.5)
+            watchdog.tripped.wait(10 * period + 1)
+            reaction_time = time.perf_counter() - fault_time
+            busy = (simulated.commands - commands) * 2 * serial_wait_time + \
+                (simulated.queries - queries) * reply_latency
+            port_load.append(busy / (time.perf_counter() - start))
+            loop_stop.set()
+            if loop is not None:
+                loop.join()
+            if sampler is not None:
+                sampler.stop()
+            watchdog.stop()
+            # A timeout is not a reaction time
+            if not watchdog.tripped.is_set():
+                raise RuntimeError(f'The watchdog did not trip on {kind} '
+                                   f'within {10 * period + 1}s.')
+            results[kind].append(reaction_time)
+
+    for kind, times in results.items():
+        print(f'{kind}: median {1000 * statistics.median(times):.0f}ms, '
+              f'max {1000 * max(times):.0f}ms')
+    print(f'Port load: median {100 * statistics.median(port_load):.0f}%, '
+          f'max {100 * max(port_load):.0f}%')
+    results['port load'] = port_load
+    return results
+
+
+def charge_loop_load(psu, period, stop_event):
+    """
+    Sends the commands of a charge update, a current set-point and a
+    voltage reading, every period until stop_event is set or the output is
+    locked off.
+
+    Parameters
+    ----------
+    psu : PSU.PSU
+    period : float
+    stop_event : threading.Event
+
+    Returns
+    -------
+
+    """
+    while not stop_event.wait(period) and not psu.interlock.is_set():
+        psu.iset(0.5)
+        psu.get_vout()
+
+
+if __name__ == '__main__':
+    benchmark_reaction_time()
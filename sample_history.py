@@ -0,0 +1,293 @@
+import numpy as np
+
+
+class DecimatedHistory:
+    """
+    Class keeping decimated tiers of a sample history, so a plot or an
+    export can get a given resolution without going through every sample.
+
+    Tier k has one bucket for every factor**(k + 1) samples. A bucket is
+    stored as two points, at its first and last time, holding the minimum
+    and maximum of every channel in the order they happened. The tiers are
+    updated incrementally in append, and the raw samples are not kept here.
+
+    Methods
+    -------
+    __init__
+    append
+    extend
+    resolution
+    """
+
+    def __init__(self, n_channels, factor=8):
+        """
+        Parameters
+        ----------
+        n_channels : int
+            Number of values in a sample.
+        factor : int
+            Number of buckets of one tier folded into a bucket of the next.
+        """
+        self.n_channels = n_channels
+        self.factor = factor
+        self.samples = 0
+        self.tier_times = []
+        self.tier_values = []
+        self.open_buckets = []
+
+    def __len__(self):
+        return self.samples
+
+    def append(self, time_stamp, values):
+        """
+        Adds a sample to the tiers.
+
+        Parameters
+        ----------
+        time_stamp : float
+            Posix time of the sample.
+        values : sequence[float]
+            One value per channel.
+
+        Returns
+        -------
+
+        """
+        self.samples += 1
+        bucket = [time_stamp, time_stamp, 1, list(values), [time_stamp] *
+                  self.n_channels, list(values), [time_stamp] *
+                  self.n_channels]
+        level = 0
+        while bucket is not None:
+            if level == len(self.open_buckets):
+                self.open_buckets.append(None)
+                self.tier_times.append([])
+                self.tier_values.append([])
+            bucket = self._merge(level, bucket)
+            level += 1
+
+    def extend(self, times, values):
+        """
+        Adds many samples to the tiers, giving the same tiers as appending
+        them one by one. Whole buckets are folded with numpy, so restoring a
+        long history does not take a python call per sample.
+
+        Parameters
+        ----------
+        times : numpy.ndarray
+            Posix times of the samples.
+        values : numpy.ndarray
+            Values with one column per channel.
+
+        Returns
+        -------
+
+        """
+        times = np.asarray(times, dtype=float)
+        values = np.asarray(values, dtype=float).reshape(-1, self.n_channels)
+        self.samples += len(times)
+        sample_times = np.repeat(times[:, None], self.n_channels, axis=1)
+        buckets = (times, times, values, sample_times, values, sample_times)
+        level = 0
+        while len(buckets[0]):
+            if level == len(self.open_buckets):
+                self.open_buckets.append(None)
+                self.tier_times.append([])
+                self.tier_values.append([])
+            buckets = self._extend_level(level, buckets)
+            level += 1
+
+    def _extend_level(self, level, buckets):
+        first_time, last_time, minimum, minimum_time, maximum, \
+            maximum_time = buckets
+        # Bucket by bucket until the open bucket of the level is closed
+        closed = []
+        index = 0
+        while index < len(first_time) and \
+                self.open_buckets[level] is not None:
+            bucket = self._merge(level, self._bucket(buckets, index))
+            if bucket is not None:
+                closed.append(bucket)
+            index += 1
+
+        # Whole groups of factor buckets at once
+        groups = (len(first_time) - index) // self.factor
+        stop = index + groups * self.factor
+        shape = (groups, self.factor, self.n_channels)
+        minimum_index = minimum[index:stop].reshape(shape).argmin(axis=1)
+        maximum_index = maximum[index:stop].reshape(shape).argmax(axis=1)
+
+        def pick(array, order):
+            return np.take_along_axis(array[index:stop].reshape(shape),
+                                      order[:, None], axis=1)[:, 0]
+
+        folded = (first_time[index:stop:self.factor],
+                  last_time[index + self.factor - 1:stop:self.factor],
+                  pick(minimum, minimum_index),
+                  pick(minimum_time, minimum_index),
+                  pick(maximum, maximum_index),
+                  pick(maximum_time, maximum_index))
+        self._emit_many(folded, self.tier_times[level],
+                        self.tier_values[level])
+
+        # The rest is left in the open bucket
+        for index in range(stop, len(first_time)):
+            self._merge(level, self._bucket(buckets, index))
+
+        if closed:
+            folded = tuple(np.concatenate([np.array(
+                [bucket[field] for bucket in closed], dtype=float),
+                array]) for field, array in zip((0, 1, 3, 4, 5, 6), folded))
+        return folded
+
+    def _bucket(self, buckets, index):
+        first_time, last_time, minimum, minimum_time, maximum, \
+            maximum_time = buckets
+        return [float(first_time[index]), float(last_time[index]), 1,
+                minimum[index].tolist(), minimum_time[index].tolist(),
+                maximum[index].tolist(), maximum_time[index].tolist()]
+
+    def _emit_many(self, buckets, times, values):
+        first_time, last_time, minimum, minimum_time, maximum, \
+            maximum_time = buckets
+        in_order = minimum_time <= maximum_time
+        first = np.where(in_order, minimum, maximum)
+        last = np.where(in_order, maximum, minimum)
+        single = first_time == last_time
+        new_times = np.column_stack([first_time, last_time])
+        new_values = np.stack([np.where(single[:, None], minimum, first),
+                               last], axis=1)
+        # A bucket of samples at the same time is a single point
+        keep = np.column_stack([np.ones(len(single), dtype=bool), ~single])
+        times.extend(new_times[keep].tolist())
+        values.extend(new_values[keep].tolist())
+
+    def resolution(self, max_points, lttb_channel=None):
+        """
+        Gives the history with at most about max_points points, from the
+        finest tier that is small enough. The open buckets are added at the
+        end so the newest samples are always included.
+
+        Parameters
+        ----------
+        max_points : int
+            Wanted number of points.
+        lttb_channel : int or None
+            If set, the finest tier with less than factor * max_points
+            points is reduced to max_points with LTTB on this channel.
+
+        Returns
+        -------
+        numpy.ndarray
+            Posix times.
+        numpy.ndarray
+            Values with one column per channel.
+        """
+        if not self.open_buckets:
+            return np.empty(0), np.empty((0, self.n_channels))
+        limit = max_points if lttb_channel is None else \
+            max_points * self.factor
+        level = 0
+        while level < len(self.tier_times) - 1 and \
+                len(self.tier_times[level]) + 2 * (level + 1) > limit:
+            level += 1
+
+        times = list(self.tier_times[level])
+        values = list(self.tier_values[level])
+        for open_level in range(level, -1, -1):
+            bucket = self.open_buckets[open_level]
+            if bucket is not None:
+                self._emit(bucket, times, values)
+        times = np.array(times)
+        values = np.array(values, dtype=float).reshape(-1, self.n_channels)
+
+        if lttb_channel is not None and len(times) > max_points:
+            index = lttb(times, values[:, lttb_channel], max_points)
+            times = times[index]
+            values = values[index]
+        return times, values
+
+    def _merge(self, level, bucket):
+        open_bucket = self.open_buckets[level]
+        if open_bucket is None:
+            open_bucket = [bucket[0], bucket[1], 1, list(bucket[3]),
+                           list(bucket[4]), list(bucket[5]), list(bucket[6])]
+        else:
+            open_bucket[1] = bucket[1]
+            open_bucket[2] += 1
+            for channel in range(self.n_channels):
+                if bucket[3][channel] < open_bucket[3][channel]:
+                    open_bucket[3][channel] = bucket[3][channel]
+                    open_bucket[4][channel] = bucket[4][channel]
+                if bucket[5][channel] > open_bucket[5][channel]:
+                    open_bucket[5][channel] = bucket[5][channel]
+                    open_bucket[6][channel] = bucket[6][channel]
+
+        if open_bucket[2] < self.factor:
+            self.open_buckets[level] = open_bucket
+            return None
+        self.open_buckets[level] = None
+        self._emit(open_bucket, self.tier_times[level],
+                   self.tier_values[level])
+        return open_bucket
+
+    def _emit(self, bucket, times, values):
+        first_time, last_time, _, minimum, minimum_time, maximum, \
+            maximum_time = bucket
+        if first_time == last_time:
+            times.append(first_time)
+            values.append(list(minimum))
+            return
+        first = []
+        last = []
+        for channel in range(self.n_channels):
+            if minimum_time[channel] <= maximum_time[channel]:
+                first.append(minimum[channel])
+                last.append(maximum[channel])
+            else:
+                first.append(maximum[channel])
+                last.append(minimum[channel])
+        times.append(first_time)
+        values.append(first)
+        times.append(last_time)
+        values.append(last)
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        Increasing x values, like times.
+    y : numpy.ndarray
+        The values.
+    n_out : int
+        Number of points wanted, at least 3.
+
+    Returns
+    -------
+    numpy.ndarray
+        Indices of the chosen points.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    chosen = np.empty(n_out, dtype=int)
+    chosen[0] = 0
+    chosen[-1] = n - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        next_stop = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_start = stop if bucket + 2 < len(edges) else n - 1
+        mean_x = x[next_start:next_stop].mean()
+        mean_y = y[next_start:next_stop].mean()
+        area = np.abs((x[previous] - mean_x) * (y[start:stop] - y[previous])
+                      - (x[previous] - x[start:stop]) * (mean_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        chosen[bucket + 1] = previous
+    return chosen
@@ -0,0 +1,207 @@
+import threading
+import time
+from collections import deque
+
+
+class Sampler:
+    """
+    Class measuring the output current and voltage of a PSU at a fixed
+    rate in a background thread, sharing the port through PSU.lock.
+
+    The samples go to a bounded deque, dropping the oldest when full. Only
+    the sampler thread appends and consumers only pop, which deque does
+    atomically, so no other lock is needed. The latest sample and the
+    charge and energy since the start are plain attributes written only by
+    the sampler thread.
+
+    While paused nothing is sampled or integrated, for when the output is
+    changed on purpose, like during find_voltage_battery.
+
+    A failed sample is counted and the thread goes on. check raises if the
+    thread has stopped or the latest sample is too old, so the values are
+    not used stale.
+
+    Methods
+    -------
+    __init__
+    start
+    stop
+    pause
+    resume
+    check
+    drain
+    """
+
+    def __init__(self, psu, rate=1.0, maxlen=100000, ampere_hours=0.0,
+                 energy=0.0, max_age=5.0):
+        """
+        Parameters
+        ----------
+        psu : PSU.PSU
+        rate : float
+            Samples per second.
+        maxlen : int
+            Samples kept for drain.
+        ampere_hours : float
+            Charge to count from.
+        energy : float
+            Energy to count from.
+        max_age : float
+            Seconds after which the latest sample is too old for check.
+
+        Attributes
+        ----------
+        self.latest : tuple or None
+            Posix time, current and voltage of the newest sample.
+        self.ampere_hours : float
+        self.energy : float
+        self.count : int
+        self.missed : int
+            Sample times skipped since the PSU was too slow.
+        self.errors : int
+            Failed samples.
+        self.error : Exception or None
+            The last error.
+        """
+        self.psu = psu
+        self.period = 1 / rate
+        self.samples = deque(maxlen=maxlen)
+        self.latest = None
+        self.ampere_hours = ampere_hours
+        self.energy = energy
+        self.count = 0
+        self.missed = 0
+        self.errors = 0
+        self.error = None
+        self.max_age = max_age
+        self.stop_event = threading.Event()
+        self.paused = threading.Event()
+        # Held while sampling, so pause can wait for a sample being taken
+        self.sample_lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        """
+        Takes the first sample, so latest is set, and starts the thread.
+
+        Returns
+        -------
+
+        """
+        self.stop_event.clear()
+        start = time.monotonic()
+        self._store(self._sample())
+        self.thread = threading.Thread(target=self._run, args=(start,),
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the thread.
+
+        Returns
+        -------
+
+        """
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+    def pause(self):
+        """
+        Pauses the sampling. A sample being taken is finished first.
+
+        Returns
+        -------
+
+        """
+        with self.sample_lock:
+            self.paused.set()
+
+    def resume(self):
+        """
+        Resumes the sampling. The paused time is not integrated.
+
+        Returns
+        -------
+
+        """
+        self.paused.clear()
+
+    def check(self):
+        """
+        Raises if the thread has stopped or the latest sample is older than
+        max_age.
+
+        Returns
+        -------
+
+        """
+        if self.thread is None or not self.thread.is_alive():
+            raise RuntimeError(f'The sampler is not running. Last error: '
+                               f'{self.error}')
+        age = time.time() - self.latest[0]
+        if age > self.max_age:
+            raise RuntimeError(f'No sample for {age:.1f}s. Last error: '
+                               f'{self.error}')
+
+    def drain(self):
+        """
+        Takes all samples waiting.
+
+        Returns
+        -------
+        list[tuple]
+            Posix time, current and voltage of every sample.
+        """
+        samples = []
+        try:
+            while True:
+                samples.append(self.samples.popleft())
+        except IndexError:
+            return samples
+
+    def _run(self, start):
+        last = start
+        sample_number = 1
+        while True:
+            next_time = start + sample_number * self.period
+            if self.stop_event.wait(max(next_time - time.monotonic(), 0)):
+                return
+            with self.sample_lock:
+                now = time.monotonic()
+                if self.paused.is_set():
+                    last = now
+                else:
+                    try:
+                        sample = self._sample()
+                    except Exception as error:
+                        # The interval is integrated by the next sample
+                        self.error = error
+                        self.errors += 1
+                    else:
+                        self._integrate(now - last)
+                        self._store(sample)
+                        last = now
+            behind = int((time.monotonic() - start) / self.period)
+            if behind > sample_number:
+                self.missed += behind - sample_number
+                sample_number = behind
+            sample_number += 1
+
+    def _sample(self):
+        current = self.psu.get_iout()
+        voltage = self.psu.get_vout()
+        return time.time(), current, voltage
+
+    def _store(self, sample):
+        self.latest = sample
+        self.samples.append(sample)
+        self.count += 1
+
+    def _integrate(self, seconds):
+        _, current, voltage = self.latest
+        self.ampere_hours += seconds / 3600 * current
+        self.energy += seconds * current * voltage
@@ -0,0 +1,353 @@
+import io
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+
+JOURNAL_NAME = 'journal.csv'
+SNAPSHOT_NAME = 'snapshot.json'
+
+
+class SessionCheckpoint:
+    """
+    Class handling the checkpoints of a charge session. Every sample is
+    appended to a journal and a small snapshot of the session state is
+    written atomically now and then.
+
+    The snapshot only holds the running totals, the last sample and the
+    journal offset it covers, so it has the same size after millions of
+    samples. On resume only the journal after that offset is replayed.
+
+    Methods
+    -------
+    __init__
+    exists
+    start
+    record
+    snapshot
+    resume
+    load_history
+    close
+    """
+
+    def __init__(self, directory, snapshot_interval=60.0, snapshot_every=500):
+        """
+        Sets up the paths. Nothing is opened before start or resume.
+
+        Parameters
+        ----------
+        directory : str
+            Folder for the journal and the snapshot.
+        snapshot_interval : float
+            Maximum seconds between snapshots.
+        snapshot_every : int
+            Maximum number of samples between snapshots.
+        """
+        self.directory = directory
+        self.journal_path = os.path.join(directory, JOURNAL_NAME)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_NAME)
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_every = snapshot_every
+
+        self.journal = None
+        self.meta = {}
+        self.soc = None
+        self.samples = 0
+        self.ampere_hours = 0.0
+        self.energy = 0.0
+        self.last = None
+        self.finished = False
+        self._samples_at_snapshot = 0
+        self._time_at_snapshot = 0.0
+
+    def exists(self):
+        """
+        Checks if there is an unfinished session to resume. A session
+        without samples has nothing to resume.
+
+        Returns
+        -------
+        bool
+            If an unfinished snapshot with samples exists.
+        """
+        return can_resume(read_snapshot(self.snapshot_path))
+
+    def start(self, **meta):
+        """
+        Starts a new session, truncating any old journal.
+
+        Parameters
+        ----------
+        meta
+            Extra information stored in the snapshot, like battery and port.
+
+        Returns
+        -------
+
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.close_journal()
+        self.journal = open(self.journal_path, 'w')
+        self.meta = meta
+        self.soc = None
+        self.samples = 0
+        self.ampere_hours = 0.0
+        self.energy = 0.0
+        self.last = None
+        self.finished = False
+        self.snapshot()
+
+    def record(self, time_stamp, current, voltage, battery_voltage, soc):
+        """
+        Appends a sample to the journal and updates the running totals the
+        same way as battery_charger.amount_charged. The first sample of a
+        session is snapshotted at once, so it can be resumed from there.
+
+        Parameters
+        ----------
+        time_stamp : datetime
+            Time of the measurement.
+        current : float
+            Charging current.
+        voltage : float
+            Charging voltage.
+        battery_voltage : float
+            Battery voltage.
+        soc : int
+            The state of charge in percent.
+
+        Returns
+        -------
+
+        """
+        posix = time_stamp.timestamp()
+        self._accumulate(posix, current, voltage, battery_voltage, soc)
+        self.journal.write(f'{posix!r},{current!r},{voltage!r},'
+                           f'{battery_voltage!r},{soc}\n')
+
+        if not self._samples_at_snapshot or \
+                self.samples - self._samples_at_snapshot >= \
+                self.snapshot_every or \
+                time.monotonic() - self._time_at_snapshot >= \
+                self.snapshot_interval:
+            self.snapshot()
+
+    def snapshot(self):
+        """
+        Flushes the journal to disk and atomically replaces the snapshot.
+
+        Returns
+        -------
+
+        """
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        state = {'meta': self.meta, 'soc': self.soc, 'samples': self.samples,
+                 'ampere_hours': self.ampere_hours, 'energy': self.energy,
+                 'last': self.last, 'finished': self.finished,
+                 'journal_offset': self.journal.tell()}
+
+        temporary_path = self.snapshot_path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self.snapshot_path)
+
+        self._samples_at_snapshot = self.samples
+        self._time_at_snapshot = time.monotonic()
+
+    def resume(self):
+        """
+        Restores the session from the snapshot and replays the journal
+        written after it. A half written last line from a crash is cut off
+        before the journal is opened for appending again.
+
+        Nothing is integrated across the restart: the first sample after it
+        starts the integration again.
+
+        Returns
+        -------
+        dict or None
+            The restored state, or None if there is nothing to resume. The
+            last sample is None if no sample came after an earlier resume.
+        """
+        state = read_snapshot(self.snapshot_path)
+        if not can_resume(state):
+            return None
+
+        self.meta = state['meta']
+        self.soc = state['soc']
+        self.samples = state['samples']
+        self.ampere_hours = state['ampere_hours']
+        self.energy = state['energy']
+        self.last = state['last']
+        self.finished = False
+
+        with open(self.journal_path, 'rb+') as file:
+            file.seek(state['journal_offset'])
+            tail = file.read()
+            end = tail.rfind(b'\n') + 1
+            for line in tail[:end].splitlines():
+                self._accumulate(*parse_journal_line(line))
+            file.truncate(state['journal_offset'] + end)
+
+        last = self.last
+        self.last = None
+        self.close_journal()
+        self.journal = open(self.journal_path, 'a')
+        self.snapshot()
+        return {'meta': self.meta, 'soc': self.soc, 'samples': self.samples,
+                'ampere_hours': self.ampere_hours, 'energy': self.energy,
+                'last': last}
+
+    def load_history(self):
+        """
+        Reads the whole journal back into history arrays. The journal is
+        parsed by pandas and the times are converted all at once, since a
+        long session has millions of lines.
+
+        Returns
+        -------
+        numpy.ndarray
+            Local times of the measurements as datetime64.
+        numpy.ndarray
+            Charging currents.
+        numpy.ndarray
+            Charging voltages.
+        numpy.ndarray
+            Battery voltages.
+        """
+        with open(self.journal_path, 'rb') as file:
+            content = file.read()
+        # A half written last line from a crash is left out
+        content = content[:content.rfind(b'\n') + 1]
+        if not content:
+            return np.empty(0, dtype='datetime64[us]'), np.empty(0), \
+                np.empty(0), np.empty(0)
+        df = pd.read_csv(io.BytesIO(content), header=None,
+                         names=['Posix', 'Current', 'Voltage',
+                                'Battery Voltage', 'SOC'],
+                         dtype=float)
+        return local_times(df['Posix'].to_numpy()), \
+            df['Current'].to_numpy(), df['Voltage'].to_numpy(), \
+            df['Battery Voltage'].to_numpy()
+
+    def close(self, finished=True):
+        """
+        Writes a last snapshot and closes the journal.
+
+        Parameters
+        ----------
+        finished : bool
+            Marks the session as done so it will not be resumed.
+
+        Returns
+        -------
+
+        """
+        if self.journal is None:
+            return
+        self.finished = finished
+        self.snapshot()
+        self.close_journal()
+
+    def close_journal(self):
+        """
+        Closes the journal file if it is open.
+
+        Returns
+        -------
+
+        """
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def _accumulate(self, posix, current, voltage, battery_voltage, soc):
+        if self.last is not None:
+            seconds = posix - self.last[0]
+            self.ampere_hours += seconds / 3600 * self.last[1]
+            self.energy += seconds * self.last[1] * self.last[2]
+        self.last = [posix, current, voltage, battery_voltage]
+        self.soc = soc
+        self.samples += 1
+
+
+def parse_journal_line(line):
+    """
+    Parses one line of the journal.
+
+    Parameters
+    ----------
+    line : bytes
+
+    Returns
+    -------
+    tuple
+        Posix time, current, voltage, battery voltage and SOC.
+    """
+    posix, current, voltage, battery_voltage, soc = line.split(b',')
+    return float(posix), float(current), float(voltage), \
+        float(battery_voltage), int(soc)
+
+
+def local_times(posix):
+    """
+    Converts posix times to local times, like datetime.fromtimestamp does
+    one by one. The UTC offset is looked up once per quarter of an hour.
+
+    Parameters
+    ----------
+    posix : numpy.ndarray
+
+    Returns
+    -------
+    numpy.ndarray
+        Local times as datetime64.
+    """
+    quarters, inverse = np.unique(np.floor(posix / 900) * 900,
+                                  return_inverse=True)
+    offsets = np.array([time.localtime(quarter).tm_gmtoff
+                        for quarter in quarters], dtype=float)
+    seconds = posix + offsets[inverse.reshape(-1)]
+    return np.round(seconds * 1e6).astype('int64').astype('datetime64[us]')
+
+
+def read_snapshot(path):
+    """
+    Reads a snapshot file.
+
+    Parameters
+    ----------
+    path : str
+
+    Returns
+    -------
+    dict or None
+        The snapshot, or None if there is none.
+    """
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def can_resume(state):
+    """
+    Parameters
+    ----------
+    state : dict or None
+        A snapshot from read_snapshot.
+
+    Returns
+    -------
+    bool
+        If the snapshot is of an unfinished session with samples.
+    """
+    return state is not None and not state['finished'] and \
+        state['samples'] > 0
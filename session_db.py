@@ -0,0 +1,355 @@
+import argparse
+import glob
+import os
+import re
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import yaml
+
+import battery_charger
+import batch_analysis
+from binary_log import as_seconds, to_seconds
+
+
+DEFAULT_DB = 'Data/sessions.db'
+# Times are seconds as in binary_log.to_seconds
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    source TEXT UNIQUE,
+    battery TEXT,
+    cell TEXT,
+    port TEXT,
+    identification TEXT,
+    start_time REAL,
+    end_time REAL,
+    start_soc REAL,
+    end_soc REAL,
+    ampere_hours REAL,
+    energy REAL,
+    rated_capacity REAL,
+    capacity REAL,
+    samples INTEGER
+);
+CREATE INDEX IF NOT EXISTS sessions_battery_time
+    ON sessions (battery, start_time);
+CREATE INDEX IF NOT EXISTS sessions_time ON sessions (start_time);
+CREATE INDEX IF NOT EXISTS sessions_cell_time ON sessions (cell, start_time);
+CREATE TABLE IF NOT EXISTS samples (
+    session_id INTEGER NOT NULL REFERENCES sessions (id),
+    time REAL NOT NULL,
+    current REAL,
+    voltage REAL,
+    battery_voltage REAL
+);
+CREATE INDEX IF NOT EXISTS samples_session_time
+    ON samples (session_id, time);
+"""
+
+
+def connect(filename=DEFAULT_DB):
+    """
+    Opens the session database, making it if needed. A database from
+    before cells were stored gets the cell column.
+
+    Parameters
+    ----------
+    filename : str
+
+    Returns
+    -------
+    sqlite3.Connection
+    """
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(filename)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    columns = [row[1] for row in connection.execute(
+        'PRAGMA table_info(sessions)')]
+    if columns and 'cell' not in columns:
+        connection.execute('ALTER TABLE sessions ADD COLUMN cell TEXT')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def add_session(connection, time_history, current_history, voltage_history,
+                battery_voltage_history, battery=None, battery_params=None,
+                port=None, identification=None, source=None, cell=None):
+    """
+    Adds a session and its samples in one transaction. A session with the
+    same source is replaced, since the file was written again.
+
+    The SOC is estimated from the first and last battery voltage if
+    battery_params is given. The capacity is the charged Ah divided by the
+    change in SOC, as in batch_analysis.analyse_log, and is only given if
+    the SOC changed by at least 10%.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+    time_history : list[datetime] or numpy.ndarray
+    current_history : list[float] or numpy.ndarray
+    voltage_history : list[float] or numpy.ndarray
+    battery_voltage_history : list[float] or numpy.ndarray
+    battery : str or None
+    battery_params : dict or None
+        The parameters of the battery.
+    port : str or None
+    identification : str or None
+        The *IDN? reply of the PSU.
+    source : str or None
+        The file the session was saved to.
+    cell : str or None
+        The cell charged.
+
+    Returns
+    -------
+    int
+        The id of the session.
+    """
+    times = to_seconds(time_history)
+    current = np.asarray(current_history, dtype=float)
+    voltage = np.asarray(voltage_history, dtype=float)
+    battery_voltage = np.asarray(battery_voltage_history, dtype=float)
+    ampere_hours, energy = battery_charger.amount_charged(
+        current, voltage, time_history)
+    start_soc = end_soc = rated_capacity = capacity = None
+    if battery_params is not None and len(times):
+        start_soc, end_soc = batch_analysis.soc_from_ocv(
+            battery_voltage[[0, -1]], battery_params).tolist()
+        rated_capacity = battery_params.get('Capacity')
+        if end_soc - start_soc >= 10:
+            capacity = ampere_hours / ((end_soc - start_soc) / 100)
+
+    with connection:
+        if source is not None:
+            delete_session(connection, source=source)
+        cursor = connection.execute(
+            'INSERT INTO sessions (source, battery, cell, port, '
+            'identification, start_time, end_time, start_soc, end_soc, '
+            'ampere_hours, energy, rated_capacity, capacity, samples) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (source, battery, cell, port, identification,
+             float(times[0]) if len(times) else None,
+             float(times[-1]) if len(times) else None,
+             start_soc, end_soc, ampere_hours, energy, rated_capacity,
+             capacity, len(times)))
+        session_id = cursor.lastrowid
+        connection.executemany(
+            'INSERT INTO samples VALUES (?, ?, ?, ?, ?)',
+            zip([session_id] * len(times), times.tolist(), current.tolist(),
+                voltage.tolist(), battery_voltage.tolist()))
+    return session_id
+
+
+def delete_session(connection, session_id=None, source=None):
+    """
+    Deletes a session and its samples, by id or by source.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+    session_id : int or None
+    source : str or None
+
+    Returns
+    -------
+
+    """
+    if session_id is None:
+        row = connection.execute('SELECT id FROM sessions WHERE source = ?',
+                                 (source,)).fetchone()
+        if row is None:
+            return
+        session_id = row[0]
+    connection.execute('DELETE FROM samples WHERE session_id = ?',
+                       (session_id,))
+    connection.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+
+
+def ingest_csv(connection, csv_file, battery=None, battery_params=None,
+               port=None, cell=None):
+    """
+    Adds a csv file written by save_data_csv.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+    csv_file : str
+    battery : str or None
+    battery_params : dict or None
+        The parameters of the battery.
+    port : str or None
+    cell : str or None
+
+    Returns
+    -------
+    int
+        The id of the session.
+    """
+    df = pd.read_csv(csv_file, usecols=['Time', 'Current', 'Charge Voltage',
+                                        'Battery Voltage'])
+    return add_session(connection, pd.to_datetime(df['Time']).to_numpy(),
+                       df['Current'].to_numpy(),
+                       df['Charge Voltage'].to_numpy(),
+                       df['Battery Voltage'].to_numpy(), battery,
+                       battery_params, port, source=csv_file, cell=cell)
+
+
+def ingest_archive(connection, pattern='Data/*.csv', battery=None,
+                   cell_pattern=None):
+    """
+    Adds every csv file matching the pattern which is not in the database.
+    The cell is taken from the file name as in batch_analysis.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+    pattern : str
+    battery : str or None
+        Battery in Config/battery_params.yml of all the files.
+    cell_pattern : str or None
+        Regular expression with a group named cell. None is the pattern of
+        batch_analysis.
+
+    Returns
+    -------
+    list[int]
+        The ids of the sessions added.
+    """
+    battery_params = None
+    if battery is not None:
+        with open('Config/battery_params.yml', 'r') as file:
+            battery_params = yaml.safe_load(file)[battery]
+    known = {row[0] for row in connection.execute(
+        'SELECT source FROM sessions WHERE source IS NOT NULL')}
+
+    cell_regex = re.compile(cell_pattern or batch_analysis.CELL_PATTERN)
+    added = []
+    for csv_file in sorted(glob.glob(pattern)):
+        if csv_file in known:
+            continue
+        try:
+            added.append(ingest_csv(
+                connection, csv_file, battery, battery_params,
+                cell=batch_analysis.cell_from_path(csv_file, cell_regex)))
+        except ValueError as error:
+            print(f'Skipped {csv_file}: {error}')
+    return added
+
+
+def query_sessions(connection, battery=None, port=None, since=None,
+                   until=None, min_capacity=None, max_capacity=None,
+                   cell=None):
+    """
+    Finds sessions. All the filters given must match.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+    battery : str or None
+    port : str or None
+    since : datetime, float or None
+        Earliest start.
+    until : datetime, float or None
+        Start before this.
+    min_capacity : float or None
+        Smallest measured capacity in Ah.
+    max_capacity : float or None
+        Measured capacity in Ah below this.
+    cell : str or None
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per session, with start_time and end_time as datetimes.
+    """
+    conditions = []
+    values = []
+    for condition, value in (('battery = ?', battery), ('port = ?', port),
+                             ('start_time >= ?', since),
+                             ('start_time < ?', until),
+                             ('capacity >= ?', min_capacity),
+                             ('capacity < ?', max_capacity),
+                             ('cell = ?', cell)):
+        if value is not None:
+            conditions.append(condition)
+            values.append(as_seconds(value) if 'time' in condition
+                          else value)
+    sql = 'SELECT * FROM sessions'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    df = pd.read_sql_query(sql + ' ORDER BY start_time', connection,
+                           params=values)
+    for column in ('start_time', 'end_time'):
+        df[column] = pd.to_datetime(df[column], unit='s')
+    return df
+
+
+def load_samples(connection, session_id, start=None, end=None):
+    """
+    Gives the samples of a session, from start up to, not including, end.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+    session_id : int
+    start : datetime, float or None
+    end : datetime, float or None
+
+    Returns
+    -------
+    pandas.DataFrame
+        Time, Current, Charge Voltage and Battery Voltage, like
+        save_data_csv.
+    """
+    sql = 'SELECT time, current, voltage, battery_voltage FROM samples ' \
+          'WHERE session_id = ?'
+    values = [session_id]
+    if start is not None:
+        sql += ' AND time >= ?'
+        values.append(as_seconds(start))
+    if end is not None:
+        sql += ' AND time < ?'
+        values.append(as_seconds(end))
+    df = pd.read_sql_query(sql + ' ORDER BY time', connection, params=values)
+    df.columns = ['Time', 'Current', 'Charge Voltage', 'Battery Voltage']
+    df['Time'] = pd.to_datetime(df['Time'], unit='s')
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Adds charge logs to the session database and finds '
+                    'sessions in it.')
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--ingest', default=None, metavar='PATTERN',
+                        help='Add the csv files matching the pattern')
+    parser.add_argument('--battery', default=None,
+                        help='Battery in Config/battery_params.yml')
+    parser.add_argument('--port', default=None)
+    parser.add_argument('--cell', default=None)
+    parser.add_argument('--since', default=None, help='Like 2024-05-01')
+    parser.add_argument('--until', default=None)
+    parser.add_argument('--max-capacity', type=float, default=None,
+                        help='Ah')
+    args = parser.parse_args()
+
+    connection = connect(args.db)
+    if args.ingest is not None:
+        added = ingest_archive(connection, args.ingest, args.battery)
+        print(f'Added {len(added)} sessions')
+    since = None if args.since is None else pd.Timestamp(args.since)
+    until = None if args.until is None else pd.Timestamp(args.until)
+    print(query_sessions(connection, args.battery, args.port, since, until,
+                         max_capacity=args.max_capacity,
+                         cell=args.cell).to_string())
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+import threading
+import time
+
+import numpy as np
+
+
+class SimulatedSerial:
+    """
+    Class standing in for the serial connection to a PSU with a battery
+    connected, for running the code without hardware. Give it to PSU.PSU
+    instead of a port.
+
+    The PSU is a CC/CV source and the battery an open circuit voltage from
+    a SOC table behind an internal resistance. The battery state is moved
+    forward on every command. Faults can be injected to test the safety
+    code, and every command is counted.
+
+    Methods
+    -------
+    __init__
+    write
+    flush
+    read_until
+    close
+    inject_ocp
+    inject_disconnect
+    set_open_circuit_voltage
+    """
+
+    def __init__(self, battery_params=None, soc=50.0, capacity=None,
+                 resistance=0.1, time_scale=1.0, reply_latency=0.0,
+                 identification=b'VELLEMANLABPS3005DV2.0'):
+        """
+        Parameters
+        ----------
+        battery_params : dict or None
+            One battery of battery_params.yml, for the SOC_OCV table and the
+            capacity. None is a Li-Ion like 3.0-4.2V battery.
+        soc : float
+            Starting SOC in percent.
+        capacity : float or None
+            Capacity in Ah. None takes it from battery_params, or 1Ah.
+        resistance : float
+            Internal resistance in ohms.
+        time_scale : float
+            Simulated seconds per real second.
+        reply_latency : float
+            Seconds the device takes to answer a query.
+        identification : bytes
+            The reply to *IDN?.
+
+        Attributes
+        ----------
+        self.commands : int
+            Number of commands received.
+        self.queries : int
+            Number of commands answered.
+        self.output_off_time : float or None
+            time.perf_counter when the output was last turned off.
+        """
+        if battery_params is not None:
+            soc_keys = sorted(battery_params['SOC_OCV'])
+            self.ocv_soc = np.array(soc_keys, dtype=float)
+            self.ocv_voltage = np.array([battery_params['SOC_OCV'][key]
+                                         for key in soc_keys])
+            if capacity is None:
+                capacity = battery_params.get('Capacity')
+        else:
+            self.ocv_soc = np.array([0.0, 100.0])
+            self.ocv_voltage = np.array([3.0, 4.2])
+        self.capacity = capacity or 1.0
+        self.soc = soc
+        self.resistance = resistance
+        self.time_scale = time_scale
+        self.reply_latency = reply_latency
+        self.identification = identification
+
+        self.vset = 0.0
+        self.iset = 0.0
+        self.on = False
+        self.ocp = False
+        self.disconnected = False
+        self.ocv_override = None
+        self.current = 0.0
+        self.cv = False
+        self.replies = []
+        self.commands = 0
+        self.queries = 0
+        self.output_off_time = None
+        self.is_open = True
+        self.last_time = time.monotonic()
+        self.state_lock = threading.Lock()
+
+    def write(self, data):
+        """
+        Handles a command, with or without the end characters.
+
+        Parameters
+        ----------
+        data : bytes
+
+        Returns
+        -------
+        int
+            Number of bytes written.
+        """
+        command = data.split(b'\\r\\n')[0].strip()
+        with self.state_lock:
+            self._advance()
+            self.commands += 1
+            if self.disconnected:
+                return len(data)
+            reply = self._handle(command)
+            if reply is not None:
+                self.queries += 1
+                self.replies.append(reply + b'\n')
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def read_until(self, expected=b'\n', size=None):
+        """
+        Gives the oldest reply, or b'' like a timeout if there is none.
+
+        Returns
+        -------
+        bytes
+        """
+        if self.reply_latency:
+            time.sleep(self.reply_latency)
+        with self.state_lock:
+            if self.replies:
+                return self.replies.pop(0)
+        return b''
+
+    def close(self):
+        self.is_open = False
+
+    def inject_ocp(self):
+        """
+        Trips the over current protection, which turns the output off.
+
+        Returns
+        -------
+
+        """
+        with self.state_lock:
+            self.ocp = True
+            self._output(False)
+
+    def inject_disconnect(self):
+        """
+        Stops the device from answering, like an unplugged cable.
+
+        Returns
+        -------
+
+        """
+        with self.state_lock:
+            self.disconnected = True
+
+    def set_open_circuit_voltage(self, voltage):
+        """
+        Overrides the battery voltage, like a faulty cell.
+
+        Parameters
+        ----------
+        voltage : float or None
+            None goes back to the SOC table.
+
+        Returns
+        -------
+
+        """
+        with self.state_lock:
+            self.ocv_override = voltage
+
+    def _open_circuit_voltage(self):
+        if self.ocv_override is not None:
+            return self.ocv_override
+        return float(np.interp(self.soc, self.ocv_soc, self.ocv_voltage))
+
+    def _advance(self):
+        now = time.monotonic()
+        seconds = (now - self.last_time) * self.time_scale
+        self.last_time = now
+        self.soc = min(self.soc + 100 * self.current * seconds / 3600 /
+                       self.capacity, 100.0)
+
+        ocv = self._open_circuit_voltage()
+        if not self.on:
+            self.current = 0.0
+            self.cv = False
+        elif ocv + self.iset * self.resistance > self.vset:
+            self.current = max((self.vset - ocv) / self.resistance, 0.0)
+            self.cv = True
+        else:
+            self.current = self.iset
+            self.cv = False
+
+    def _output(self, on):
+        self.on = on
+        if not on:
+            self.output_off_time = time.perf_counter()
+        self._advance()
+
+    def _handle(self, command):
+        if command == b'*IDN?':
+            return self.identification
+        if command == b'STATUS?':
+            return b''.join(b'1' if flag else b'0'
+                            for flag in (self.cv, self.on, self.ocp))
+        if command == b'OUTPUT1':
+            self._output(True)
+            return None
+        if command == b'OUTPUT0':
+            self._output(False)
+            return None
+        if command.startswith(b'VSET1:'):
+            self.vset = float(command[6:])
+            self._advance()
+            return None
+        if command.startswith(b'ISET1:'):
+            self.iset = float(command[6:])
+            self._advance()
+            return None
+        if command == b'VSET1?':
+            return f'{self.vset:05.2f}'.encode()
+        if command == b'ISET1?':
+            return f'{self.iset:05.3f}'.encode()
+        if command == b'VOUT1?':
+            voltage = 0.0
+            if self.on:
+                voltage = self._open_circuit_voltage() + \
+                    self.current * self.resistance
+            return f'{voltage:05.2f}'.encode()
+        if command == b'IOUT1?':
+            return f'{self.current:05.3f}'.encode()
+        return None
@@ -0,0 +1,208 @@
+import math
+from collections import deque
+
+
+CONTINUE = 'continue'
+STEP_DOWN = 'step_down'
+STOP = 'stop'
+
+
+class RollingRegression:
+    """
+    Class keeping a least squares line over the samples of the last window
+    seconds. The sums are updated when samples enter and leave, so adding a
+    sample costs the same however long the window is.
+
+    Methods
+    -------
+    __init__
+    add
+    slope
+    span
+    """
+
+    def __init__(self, window):
+        """
+        Parameters
+        ----------
+        window : float
+            Seconds of samples to keep.
+        """
+        self.window = window
+        self.samples = deque()
+        self.origin = None
+        self.sum_x = 0.0
+        self.sum_y = 0.0
+        self.sum_xx = 0.0
+        self.sum_xy = 0.0
+
+    def add(self, time_s, value):
+        """
+        Parameters
+        ----------
+        time_s : float
+            Seconds, increasing.
+        value : float
+
+        Returns
+        -------
+
+        """
+        if self.origin is None:
+            self.origin = time_s
+        x = time_s - self.origin
+        self.samples.append((x, value))
+        self._change(x, value, 1)
+        while x - self.samples[0][0] > self.window:
+            old_x, old_value = self.samples.popleft()
+            self._change(old_x, old_value, -1)
+
+    def slope(self):
+        """
+        Gives the slope of the line.
+
+        Returns
+        -------
+        float or None
+            Change per second. None if there are too few samples.
+        """
+        n = len(self.samples)
+        if n < 3:
+            return None
+        denominator = n * self.sum_xx - self.sum_x ** 2
+        if denominator <= 0:
+            return None
+        return (n * self.sum_xy - self.sum_x * self.sum_y) / denominator
+
+    def span(self):
+        """
+        Returns
+        -------
+        float
+            Seconds between the first and last sample in the window.
+        """
+        if not self.samples:
+            return 0.0
+        return self.samples[-1][0] - self.samples[0][0]
+
+    def _change(self, x, value, sign):
+        self.sum_x += sign * x
+        self.sum_y += sign * value
+        self.sum_xx += sign * x * x
+        self.sum_xy += sign * x * value
+
+
+class TerminationEngine:
+    """
+    Class deciding when a charge is done from streaming statistics of the
+    charging voltage and current: the rolling dV/dt, the taper rate of the
+    current in CV and the time spent in CV.
+
+    The charge is stopped when the current in CV reaches the cutoff, when
+    it has been in CV for too long, or when the voltage falls by more than
+    dVdtDrop per second. If the CV current stops tapering above the cutoff,
+    the current is stepped down.
+
+    Methods
+    -------
+    __init__
+    update
+    time_to_full
+    """
+
+    def __init__(self, cutoff_current, cv_voltage, params):
+        """
+        Parameters
+        ----------
+        cutoff_current : float
+            Current in amperes where the charge is done.
+        cv_voltage : float
+            The charging voltage.
+        params : dict
+            The Termination section of charge_params.yml.
+        """
+        self.cutoff_current = cutoff_current
+        self.cv_voltage = cv_voltage
+        self.cv_tolerance = params['CVTolerance']
+        self.cv_time_max = params['CVTimeMax']
+        self.dvdt_drop = params['dVdtDrop']
+        self.taper_min = params['TaperMin']
+        self.window = params['Window']
+
+        self.voltage_regression = RollingRegression(self.window)
+        self.log_current_regression = RollingRegression(self.window)
+        self.last_time = None
+        self.last_current = None
+        self.cv = False
+        self.time_in_cv = 0.0
+        self.dvdt = None
+        self.taper = None
+
+    def update(self, time_s, voltage, current):
+        """
+        Adds a sample and decides what to do.
+
+        Parameters
+        ----------
+        time_s : float
+            Seconds, like time.monotonic.
+        voltage : float
+            Charging voltage.
+        current : float
+            Charging current.
+
+        Returns
+        -------
+        str
+            CONTINUE, STEP_DOWN or STOP.
+        """
+        cv = voltage >= self.cv_voltage - self.cv_tolerance
+        if cv and self.cv and self.last_time is not None:
+            self.time_in_cv += time_s - self.last_time
+        if cv and not self.cv:
+            # The taper rate only makes sense within the CV phase
+            self.log_current_regression = RollingRegression(self.window)
+        self.cv = cv
+        self.last_time = time_s
+        self.last_current = current
+
+        self.voltage_regression.add(time_s, voltage)
+        self.dvdt = self.voltage_regression.slope()
+        if cv and current > 0:
+            self.log_current_regression.add(time_s, math.log(current))
+            slope = self.log_current_regression.slope()
+            self.taper = None if slope is None else -slope
+        else:
+            self.taper = None
+
+        if cv and current <= self.cutoff_current:
+            return STOP
+        if cv and self.time_in_cv >= self.cv_time_max:
+            return STOP
+        full_window = self.voltage_regression.span() >= self.window / 2
+        if full_window and self.dvdt is not None and \
+                self.dvdt <= -self.dvdt_drop:
+            return STOP
+        if full_window and self.taper is not None and \
+                self.log_current_regression.span() >= self.window / 2 and \
+                self.taper < self.taper_min:
+            # Waits for a new taper rate before stepping down again
+            self.log_current_regression = RollingRegression(self.window)
+            return STEP_DOWN
+        return CONTINUE
+
+    def time_to_full(self):
+        """
+        Predicts the time until the current reaches the cutoff, from the
+        exponential taper of the current in CV.
+
+        Returns
+        -------
+        float or None
+            Seconds, or None if not in CV or not tapering.
+        """
+        if not self.cv or self.taper is None or self.taper <= 0:
+            return None
+        if self.last_current <= self.cutoff_current:
+            return 0.0
+        return math.log(self.last_current / self.cutoff_current) / self.taper